@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Compare the iterparse based parse_products_xml with the original ElementTree parser.
+
+Usage: python3 benchmarks/bench_parse.py [--feed captured-products.xml] [--urlVersion 6]
+
+Without --feed a synthetic feed is generated, --scale multiplies its size.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from xml.etree import ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ccdl  # noqa: E402
+import feeds  # noqa: E402
+
+ALLOWED_PLATFORMS = ['macuniversal', 'osx10-64', 'osx10']
+
+
+def legacy_parse_products_xml(products_xml, urlVersion, allowedPlatforms):
+    """parse_products_xml as of 0.2.0, kept for comparison."""
+    if urlVersion == 6:
+        prefix = 'channels/'
+    else:
+        prefix = ''
+    cdn = products_xml.find(prefix + 'channel/cdn/secure').text
+    products = {}
+    parent_map = {c: p for p in products_xml.iter() for c in p}
+    for p in products_xml.findall(prefix + 'channel/products/product'):
+        sap = p.get('id')
+        hidden = parent_map[parent_map[p]].get('name') != 'ccm'
+        displayName = p.find('displayName').text
+        productVersion = p.get('version')
+        if not products.get(sap):
+            products[sap] = {
+                'hidden': hidden,
+                'displayName': displayName,
+                'sapCode': sap,
+                'versions': OrderedDict()
+            }
+
+        for pf in p.findall('platforms/platform'):
+            baseVersion = pf.find('languageSet').get('baseVersion')
+            buildGuid = pf.find('languageSet').get('buildGuid')
+            appplatform = pf.get('id')
+            dependencies = list(pf.findall('languageSet/dependencies/dependency'))
+            if productVersion in products[sap]['versions']:
+                if products[sap]['versions'][productVersion]['apPlatform'] in allowedPlatforms:
+                    break
+
+            if sap == 'APRO':
+                baseVersion = productVersion
+                if urlVersion == 4 or urlVersion == 5:
+                    productVersion = pf.find('languageSet/nglLicensingInfo/appVersion').text
+                if urlVersion == 6:
+                    for b in products_xml.findall('builds/build'):
+                        if b.get("id") == sap and b.get("version") == baseVersion:
+                            productVersion = b.find('nglLicensingInfo/appVersion').text
+                            break
+                buildGuid = pf.find('languageSet/urls/manifestURL').text
+
+            products[sap]['versions'][productVersion] = {
+                'sapCode': sap,
+                'baseVersion': baseVersion,
+                'productVersion': productVersion,
+                'apPlatform': appplatform,
+                'dependencies': [{
+                    'sapCode': d.find('sapCode').text, 'version': d.find('baseVersion').text
+                } for d in dependencies],
+                'buildGuid': buildGuid
+            }
+    return products, cdn
+
+
+def legacy(data, urlVersion):
+    products, cdn = legacy_parse_products_xml(ET.fromstring(data), urlVersion, ALLOWED_PLATFORMS)
+    ccdl.index_products(products, ALLOWED_PLATFORMS)
+    return products, cdn
+
+
+def streaming(data, urlVersion):
+    return ccdl.parse_products_xml(data, urlVersion, ALLOWED_PLATFORMS)
+
+
+def measure(fn, data, urlVersion, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(data, urlVersion)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    fn(data, urlVersion)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--feed', help='Captured products.xml to parse')
+    parser.add_argument('--urlVersion', type=int, default=6, choices=(4, 5, 6))
+    parser.add_argument('--scale', type=int, default=1, help='Size multiplier of the synthetic feed')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.feed:
+        with open(args.feed, 'rb') as f:
+            data = f.read()
+    else:
+        data = feeds.products_xml(args.urlVersion, products=60 * args.scale)
+    print('Feed: {:.1f} MB, v{}'.format(len(data) / 1e6, args.urlVersion))
+
+    results = {}
+    for name, fn in (('legacy', legacy), ('iterparse', streaming)):
+        result, best, peak = measure(fn, data, args.urlVersion, args.repeat)
+        results[name] = result
+        print('{:10} {:8.3f} s  peak {:8.1f} MB'.format(name, best, peak / 1e6))
+    if results['legacy'] != results['iterparse']:
+        sys.exit('Parsers disagree on this feed')
+    print('Both parsers produced the same catalog')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Compare the buffered download pipeline with the original 1 KiB read/write loop.
+
+The mock CDN runs in its own process, so the CPU time measured here is only
+the client's: reading the socket, writing the file and updating progress.
+
+Usage: python3 benchmarks/bench_transfer.py [--size 256M] [--bufferSizes 64K 256K 1M 4M] [--repeat 3]
+"""
+import argparse
+import functools
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import ccdl  # noqa: E402
+from mock_cdn import parse_rate  # noqa: E402
+
+
+def legacy_download_stream(session, url, part_path, progress_bar):
+    """The transfer loop of download_file as of 0.2.0, kept for comparison."""
+    response = session.get(url, stream=True, headers=ccdl.ADOBE_REQ_HEADERS)
+    block_size = 1024  # 1 Kibibyte
+    with open(part_path, 'wb') as file:
+        for data in response.iter_content(block_size):
+            progress_bar.update(len(data))
+            file.write(data)
+
+
+def start_mock_cdn(core_size):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, 'mock_cdn.py'), '--port', str(port),
+                             '--coreSize', str(core_size)], stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return proc, 'http://127.0.0.1:{}'.format(port)
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError('The mock CDN did not start')
+
+
+def measure(download, url, path, size, repeat, legacy=False):
+    best = None
+    for _ in range(repeat):
+        with open(os.devnull, 'w') as devnull:
+            if legacy:
+                progress = ccdl.tqdm(total=size, unit='iB', unit_scale=True, file=devnull)
+            else:
+                progress = ccdl.ProgressFile('BENCH', '1.0', os.path.basename(path), size)
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            download(url, path, progress)
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            if legacy:
+                progress.close()
+        if os.path.getsize(path) != size:
+            raise RuntimeError('Downloaded {} of {} bytes'.format(os.path.getsize(path), size))
+        os.remove(path)
+        if best is None or wall < best['seconds']:
+            best = {
+                'seconds': round(wall, 3),
+                'mb_per_s': round(size / 1e6 / wall, 1),
+                'cpu_s_per_gb': round(cpu / (size / 1e9), 2),
+            }
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', default='256M', help='Size of the downloaded package')
+    parser.add_argument('--bufferSizes', nargs='+', default=['64K', '256K', '1M', '4M'],
+                        help='--bufferSize values to measure')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--out', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    size = parse_rate(args.size)
+    proc, cdn = start_mock_cdn(size)
+    workdir = tempfile.mkdtemp(prefix='ccdl-bench-')
+    try:
+        url = cdn + '/https/ccmdl.adobe.com/BENCH/1.0/osx10-64/BENCH-Core0.zip'
+        path = os.path.join(workdir, 'BENCH-Core0.zip')
+        results = {}
+        session = ccdl.Packager(jobs=1).transport.session
+        results['legacy_1K'] = measure(functools.partial(legacy_download_stream, session),
+                                       url, path, size, args.repeat, legacy=True)
+        print('legacy     1K  {}'.format(results['legacy_1K']))
+        for buffer_size in args.bufferSizes:
+            packager = ccdl.Packager(bufferSize=ccdl.parse_size(buffer_size))
+            result = measure(packager.downloader.download_stream, url, path, size, args.repeat)
+            results['pipeline_' + buffer_size] = result
+            print('pipeline {:>5} {}'.format(buffer_size, result))
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'size': size, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Synthetic Adobe feeds for the benchmarks.
+
+The documents follow the layout of the real products.xml (v4/v5 and v6) and
+application.json closely enough for ccdl.py to parse them, padded with the
+icon and info elements that make up most of a real feed.
+"""
+import hashlib
+import json
+import random
+
+PLATFORMS = ['macuniversal', 'macarm64', 'osx10-64']
+DEPENDENCIES = ['COSY', 'KBRG', 'CCXP', 'UXPW', 'CORE']
+LANGUAGES = ['en_US', 'de_DE', 'fr_FR', 'ja_JP', 'es_ES', 'it_IT', 'ko_KR', 'zh_CN']
+
+
+def build_guid(sap, version, platform):
+    return hashlib.md5('{}-{}-{}'.format(sap, version, platform).encode('utf-8')).hexdigest()
+
+
+def _sap_codes(count):
+    codes = []
+    for i in range(count):
+        codes.append('P{:03d}'.format(i))
+    return codes
+
+
+def catalog(products=60, versions=12, seed=1):
+    """Return [(sapCode, displayName, [(productVersion, baseVersion, platforms, deps)])]."""
+    rnd = random.Random(seed)
+    entries = []
+    for dep in DEPENDENCIES:
+        entries.append((dep, dep + ' dependency', [('{}.0'.format(v), '{}.0'.format(v), ['macuniversal'], [])
+                                                    for v in range(1, versions + 1)]))
+    for sap in ['APRO'] + _sap_codes(products):
+        vs = []
+        for v in range(1, versions + 1):
+            version = '{}.{}'.format(20 + v // 4, v % 4)
+            platforms = rnd.sample(PLATFORMS, rnd.randint(1, len(PLATFORMS)))
+            deps = [(d, '{}.0'.format(rnd.randint(1, versions))) for d in rnd.sample(DEPENDENCIES, 3)]
+            vs.append((version, version, platforms, deps))
+        entries.append((sap, 'Product ' + sap, vs))
+    return entries
+
+
+def _product_xml(out, sap, name, version, base, platforms, deps):
+    out.append('<product id="{}" version="{}"><displayName>{}</displayName>'.format(sap, version, name))
+    out.append('<productIcons>')
+    for size in ('16x16', '24x24', '32x32', '48x48', '64x64', '96x96', '128x128', '256x256', '512x512'):
+        out.append('<icon size="{0}">https://prod-rel-ffc.oobesaas.adobe.com/icons/{1}/{2}/{0}.png</icon>'.format(size, sap, version))
+    out.append('</productIcons><platforms>')
+    for pf in platforms:
+        guid = build_guid(sap, version, pf)
+        out.append('<platform id="{}"><languageSet baseVersion="{}" buildGuid="{}" productCode="{}">'.format(pf, base, guid, sap))
+        out.append('<nglLicensingInfo><appId>{0}</appId><appVersion>{1}.0.0</appVersion></nglLicensingInfo>'.format(sap, version))
+        out.append('<dependencies>')
+        for d, dv in deps:
+            out.append('<dependency><sapCode>{}</sapCode><baseVersion>{}</baseVersion></dependency>'.format(d, dv))
+        out.append('</dependencies><urls><manifestURL>/{0}/{1}/{2}/manifest.xml</manifestURL></urls>'.format(sap, version, pf))
+        out.append('<systemRequirements><minOSVersion>10.15</minOSVersion>'
+                   '<description>{}</description></systemRequirements>'.format('x' * 400))
+        out.append('</languageSet></platform>')
+    out.append('</platforms></product>')
+
+
+def products_xml(url_version, products=60, versions=12, cdn='https://ccmdl.adobe.com', seed=1):
+    """Return a synthetic products.xml for url_version 4, 5 or 6 as bytes."""
+    entries = catalog(products, versions, seed)
+    out = ['<?xml version="1.0" encoding="UTF-8"?><productList>']
+    if url_version == 6:
+        out.append('<channels>')
+    for channel in ('ccm', 'sti'):
+        out.append('<channel name="{}"><cdn><secure>{}</secure><nonSecure>{}</nonSecure></cdn><products>'.format(
+            channel, cdn, cdn.replace('https', 'http')))
+        for sap, name, vs in entries:
+            if (channel == 'sti') != (sap in DEPENDENCIES):
+                continue
+            for version, base, platforms, deps in vs:
+                _product_xml(out, sap, name, version, base, platforms, deps)
+        out.append('</products></channel>')
+    if url_version == 6:
+        out.append('</channels><builds>')
+        for sap, name, vs in entries:
+            for version, base, platforms, deps in vs:
+                out.append('<build id="{0}" version="{1}"><nglLicensingInfo><appVersion>{1}.0.0</appVersion>'
+                           '</nglLicensingInfo></build>'.format(sap, version))
+        out.append('</builds>')
+    out.append('</productList>')
+    return ''.join(out).encode('utf-8')
+
+
+def package_size(path, core_size):
+    """Size of a synthetic package, core packages are core_size, language packs smaller."""
+    if '-Core' in path:
+        return core_size
+    seed = int(hashlib.md5(path.encode('utf-8')).hexdigest()[:8], 16)
+    return core_size // 8 + seed % (core_size // 2 - core_size // 8 + 1)
+
+
+def package_block(path):
+    """64 KiB of deterministic content for a package, repeated to fill it."""
+    return hashlib.sha256(path.encode('utf-8')).digest() * 2048
+
+
+def application_json(sap, version, packages=8, core_size=1024 * 1024):
+    """Return a synthetic application.json for one build as a dict."""
+    pkgs = []
+    for i in range(packages):
+        path = '/{0}/{1}/osx10-64/{0}-Core{2}.zip'.format(sap, version, i)
+        pkgs.append({
+            'PackageName': '{}-Core{}'.format(sap, i),
+            'Path': path,
+            'Type': 'core',
+            'DownloadSize': package_size(path, core_size),
+        })
+    for lang in LANGUAGES:
+        path = '/{0}/{1}/osx10-64/{0}-{2}.zip'.format(sap, version, lang)
+        pkgs.append({
+            'PackageName': '{}-{}'.format(sap, lang),
+            'Path': path,
+            'Condition': '[installLanguage]=={}'.format(lang),
+            'DownloadSize': package_size(path, core_size),
+        })
+    return {
+        'SAPCode': sap,
+        'CodexVersion': version,
+        'SupportedLanguages': {'Language': [{'locale': lang} for lang in LANGUAGES]},
+        'Packages': {'Package': pkgs},
+    }
+
+
+if __name__ == '__main__':
+    print(json.dumps(application_json('PHSP', '25.0'), indent=2))
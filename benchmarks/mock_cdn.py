@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""A local stand-in for the Adobe servers used by the benchmarks.
+
+It answers in the URL layout of a --mirror server (/https/<host>/<path>), so
+ccdl.py can be pointed at it with --mirror http://127.0.0.1:<port>:
+
+- products.xml for v4/v5/v6 from feeds.products_xml, optionally 10x larger
+- application.json for every buildGuid of that feed
+- package blobs with the sizes listed in the manifests, with Range support
+
+Latency is added to every request and each connection can be limited to a
+bandwidth, which makes throughput numbers reproducible.
+
+Usage: python3 benchmarks/mock_cdn.py [--port 8080] [--scale 10] [--latency 0.05] [--bandwidth 50M]
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import feeds
+
+
+def parse_rate(val):
+    """Parse a byte rate such as 50M or 1.5G, 0 means unlimited."""
+    match = re.fullmatch(r'([\d.]+)([KMG]?)', val.upper())
+    if not match:
+        raise ValueError('Invalid rate: ' + val)
+    return int(float(match.group(1)) * {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[match.group(2)])
+
+
+class MockCDN:
+    """Serve synthetic feeds, manifests and packages on a background thread."""
+
+    def __init__(self, port=0, scale=1, latency=0.0, bandwidth=0, packages=8, core_size=1024 * 1024):
+        self.scale = scale
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.packages = packages
+        self.core_size = core_size
+        self.requests = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.feeds = {}
+        self.guids = {}
+        for sap, _, versions in feeds.catalog(60 * scale):
+            for version, _, platforms, _ in versions:
+                for pf in platforms:
+                    self.guids[feeds.build_guid(sap, version, pf)] = (sap, version)
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def feed(self, url_version):
+        with self.lock:
+            if url_version not in self.feeds:
+                self.feeds[url_version] = feeds.products_xml(url_version, products=60 * self.scale)
+            return self.feeds[url_version]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handler(self):
+        cdn = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                self.respond(head=True)
+
+            def do_GET(self):
+                self.respond(head=False)
+
+            def respond(self, head):
+                with cdn.lock:
+                    cdn.requests += 1
+                if cdn.latency:
+                    time.sleep(cdn.latency)
+                # Drop the /<scheme>/<host> prefix of mirror urls
+                path = '/' + self.path.lstrip('/').split('/', 2)[-1]
+                match = re.search(r'/core/v(\d)/products/all', path)
+                if match:
+                    self.send_bytes(cdn.feed(int(match.group(1))), 'application/xml', head)
+                elif path.startswith('/core/v3/applications'):
+                    build = cdn.guids.get(self.headers.get('x-adobe-build-guid', ''))
+                    if not build:
+                        self.send_error(404)
+                        return
+                    app_json = feeds.application_json(build[0], build[1], cdn.packages, cdn.core_size)
+                    self.send_bytes(json.dumps(app_json).encode('utf-8'), 'application/json', head)
+                elif path.endswith('.zip'):
+                    self.send_package(path.split('?')[0], head)
+                else:
+                    self.send_error(404)
+
+            def send_bytes(self, body, content_type, head):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if not head:
+                    self.write_throttled(memoryview(body))
+
+            def send_package(self, path, head):
+                size = feeds.package_size(path, cdn.core_size)
+                start, end, status = 0, size - 1, 200
+                match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                if match:
+                    start = int(match.group(1))
+                    end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                    status = 206
+                self.send_response(status)
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(end - start + 1))
+                if status == 206:
+                    self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+                self.end_headers()
+                if head:
+                    return
+                block = memoryview(feeds.package_block(path))
+                offset = start
+                while offset <= end:
+                    chunk = block[offset % len(block):][:end + 1 - offset]
+                    self.write_throttled(chunk)
+                    offset += len(chunk)
+
+            def write_throttled(self, data):
+                step = 64 * 1024
+                for i in range(0, len(data), step):
+                    began = time.perf_counter()
+                    self.wfile.write(data[i:i + step])
+                    sent = len(data[i:i + step])
+                    with cdn.lock:
+                        cdn.bytes_sent += sent
+                    if cdn.bandwidth:
+                        delay = sent / cdn.bandwidth - (time.perf_counter() - began)
+                        if delay > 0:
+                            time.sleep(delay)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--scale', type=int, default=1, help='Feed size multiplier')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request')
+    parser.add_argument('--bandwidth', default='0', help='Bytes per second per connection, eg. 50M (default: unlimited)')
+    parser.add_argument('--packages', type=int, default=8, help='Core packages per build')
+    parser.add_argument('--coreSize', default='1M', help='Size of a core package, eg. 64M')
+    args = parser.parse_args()
+    cdn = MockCDN(args.port, args.scale, args.latency, parse_rate(args.bandwidth), args.packages, parse_rate(args.coreSize))
+    print('Mock Adobe CDN on {}, use ccdl.py --mirror {}'.format(cdn.url, cdn.url))
+    try:
+        cdn.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
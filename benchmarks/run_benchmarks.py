@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Benchmark suite for ccdl.py against the local mock CDN.
+
+Measures catalog parse time and peak memory for the v4/v5/v6 feeds at normal
+and 10x size, dependency resolution over the whole catalog and end-to-end
+throughput of an installer build. Results are written as JSON together with
+the git commit, so runs on different commits can be compared:
+
+    python3 benchmarks/run_benchmarks.py --out before.json
+    git checkout other-branch
+    python3 benchmarks/run_benchmarks.py --out after.json --compare before.json
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import ccdl  # noqa: E402
+import feeds  # noqa: E402
+from mock_cdn import MockCDN, parse_rate  # noqa: E402
+
+ALLOWED_PLATFORMS = ['macuniversal', 'osx10-64', 'osx10']
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, text=True).strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD', '--', '../ccdl.py'], cwd=HERE) != 0
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silence the progress output of ccdl while it is measured."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        yield
+
+
+def bench_parse(url_version, scale, repeat):
+    data = feeds.products_xml(url_version, products=60 * scale)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        products, _ = ccdl.parse_products_xml(data, url_version, ALLOWED_PLATFORMS)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    ccdl.parse_products_xml(data, url_version, ALLOWED_PLATFORMS)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return products, {'feed_mb': round(len(data) / 1e6, 2), 'seconds': round(best, 4), 'peak_mb': round(peak / 1e6, 2)}
+
+
+def bench_resolve(products, repeat):
+    roots = [v for p in products.values() for v in p['versions'].values()]
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for prodInfo in roots:
+            ccdl.resolve_dependencies(products, prodInfo)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {'builds': len(roots), 'seconds': round(best, 4)}
+
+
+def fake_installer_app(install_app_path):
+    """osacompile only exists on macOS, elsewhere the benchmark builds a bare bundle."""
+    os.makedirs(os.path.join(install_app_path, 'Contents', 'Resources'), exist_ok=True)
+
+
+def bench_build(cdn, jobs, extra_args):
+    workdir = tempfile.mkdtemp(prefix='ccdl-bench-')
+    try:
+        packager = ccdl.Packager(ccdl.parse_args(['--mirror', cdn.url, '--cacheDir', os.path.join(workdir, 'cache'),
+                                                  '--destination', workdir, '--jobs', str(jobs),
+                                                  '--ignoreNoCreativeCloud'] + extra_args))
+        if not shutil.which('osacompile'):
+            ccdl.create_installer_app = fake_installer_app
+        bytes_before = cdn.bytes_sent
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        with quiet():
+            products, cdn_url = packager.catalog.get(6, ALLOWED_PLATFORMS)
+            product = products['P000']
+            prodInfo = product['versions'][product['latestVersion']]
+            build = ccdl.plan_installer(products, cdn_url, prodInfo, 'en_US', 'en_US', workdir)
+            incomplete = packager.build_installers([build])
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        if incomplete:
+            raise RuntimeError('The benchmark build is incomplete')
+        transferred = cdn.bytes_sent - bytes_before
+        return {
+            'jobs': jobs,
+            'args': ' '.join(extra_args),
+            'packages': len(build['tasks']),
+            'mb': round(transferred / 1e6, 1),
+            'seconds': round(wall, 3),
+            'mb_per_s': round(transferred / 1e6 / wall, 1),
+            'cpu_s_per_gb': round(cpu / (transferred / 1e9), 2),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(old, new):
+    print('\n{:32} {:>12} {:>12} {:>8}'.format('benchmark ({} -> {})'.format(old.get('commit'), new.get('commit')),
+                                             'old', 'new', 'change'))
+    for name, result in new['results'].items():
+        if name not in old['results']:
+            continue
+        for metric in ('seconds', 'peak_mb', 'mb_per_s', 'cpu_s_per_gb'):
+            if metric in result and metric in old['results'][name] and old['results'][name][metric]:
+                a, b = old['results'][name][metric], result[metric]
+                print('{:32} {:>12} {:>12} {:>7.0%}'.format(name + ' ' + metric, a, b, (b - a) / a))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--quick', action='store_true', help='Fewer repeats and no 10x feeds')
+    parser.add_argument('--out', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='Compare with the results of an earlier run')
+    parser.add_argument('--latency', type=float, default=0.02, help='Mock CDN latency per request in seconds')
+    parser.add_argument('--bandwidth', default='0', help='Mock CDN bandwidth per connection, eg. 20M')
+    parser.add_argument('--coreSize', default='16M', help='Size of a core package')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 4], help='--jobs values for the build benchmark')
+    parser.add_argument('--buildArgs', default='', help='Extra ccdl.py arguments for the build benchmark')
+    args = parser.parse_args()
+
+    repeat = 1 if args.quick else 5
+    scales = [1] if args.quick else [1, 10]
+    results = {}
+    for url_version in (4, 5, 6):
+        for scale in scales:
+            products, result = bench_parse(url_version, scale, repeat)
+            results['parse_v{}_x{}'.format(url_version, scale)] = result
+            print('parse v{} x{:<3} {}'.format(url_version, scale, result))
+            if url_version == 6:
+                result = bench_resolve(products, repeat)
+                results['resolve_x{}'.format(scale)] = result
+                print('resolve x{:<5} {}'.format(scale, result))
+
+    cdn = MockCDN(latency=args.latency, bandwidth=parse_rate(args.bandwidth), packages=4,
+                  core_size=parse_rate(args.coreSize)).start()
+    try:
+        for jobs in args.jobs:
+            result = bench_build(cdn, jobs, args.buildArgs.split())
+            results['build_jobs{}'.format(jobs)] = result
+            print('build jobs={:<4} {}'.format(jobs, result))
+    finally:
+        cdn.stop()
+
+    report = {
+        'commit': git_commit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {'quick': args.quick, 'latency': args.latency, 'bandwidth': args.bandwidth,
+                   'coreSize': args.coreSize},
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
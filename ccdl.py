@@ -3,6 +3,31 @@
 This is the Adobe Offline Package downloader.
 
 CHANGELOG
+(0.3.0)
++ Download packages of all products concurrently (--jobs)
++ Download large files as parallel byte ranges (--segments)
++ Resume interrupted downloads from .part files, skip journaled files without a HEAD request
++ Cache products.xml on disk and revalidate it with ETag/If-Modified-Since (--cacheTTL, --offline)
++ Cache application.json by buildGuid and fetch all needed manifests concurrently
++ Parse products.xml incrementally with iterparse
++ Index the catalog by baseVersion and resolve transitive dependencies in one pass
++ Shared package store, installers get hardlinks instead of their own copies (--store)
++ Build many installers from a manifest without prompts, every package is downloaded once (--batch)
++ Report package counts, download sizes and free space without building (--plan)
++ Caching mirror of products.xml, application.json and the CDN for a whole network (--serve, --mirror)
++ Per-phase timings and byte counters as JSON (--metrics-out) and profiling (--profile)
++ Timeouts, retries with backoff and Range continuation of interrupted downloads
++ Download rate limit with time-of-day windows, queue ordering and completion time estimates
++ Package Conditions are evaluated properly and languages are read from application.json
++ Incremental rebuilds from a previous installer, downloading only changed packages (--from)
++ Downloads read into large reusable buffers and write on a separate thread (--bufferSize)
++ Installers streamed into a single tar, tar.zst or tar.gz archive, also to stdout (--archive)
++ Packager class to build installers from other Python programs, sharing the catalog and connections
++ Build daemon with a job queue, deduplication of identical jobs and background catalog refresh (--daemon)
++ Zip structure and CRC-32 checks of the packages after a build or of an existing installer (--verify, --verifyApp)
++ Intel and Apple Silicon installers from one download, their shared packages hardlinked (--arch all)
++ One aggregate progress bar with rate, completion time and active files, or JSON lines events (--progress)
+
 (0.2.0)
 + Added v5 & v6 URL (Support Photoshop BETA)
 + Added full support for Adobe Acrobat and partial support for XD (Need bearer_token)
@@ -30,19 +55,42 @@ CHANGELOG
 + made everything even more messy and disgusting
 """
 import argparse
+import cProfile
+import ctypes
+import fcntl
+import functools
+import hashlib
+import io
 import json
 import locale
+import mmap
 import os
 import platform
+import pstats
+import queue
 import random
+import re
 import shutil
 import string
+import struct
 import sys
-from collections import OrderedDict
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
 from subprocess import PIPE, Popen
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
 from xml.etree import ElementTree as ET
 
 import requests
+import urllib3
+from requests.adapters import HTTPAdapter
 
 try:
     from tqdm.auto import tqdm
@@ -56,10 +104,9 @@ except ImportError:
                 install it from http://pypi.python.org/pypi/tqdm
                 or run: pip3 install tqdm.""")
 
-session = requests.sessions.Session()
 
 VERSION = 4
-VERSION_STR = '0.2.0'
+VERSION_STR = '0.3.0'
 CODE_QUALITY = 'Mildly_AWFUL'
 
 INSTALL_APP_APPLE_SCRIPT = '''
@@ -220,6 +267,7 @@ function run() {
 '''
 
 ADOBE_PRODUCTS_XML_URL = 'https://prod-rel-ffc-ccm.oobesaas.adobe.com/adobe-ffc-external/core/v{urlVersion}/products/all?_type=xml&channel=ccm&channel=sti&platform={installPlatform}&productType=Desktop'
+URL_VERSIONS = (4, 5, 6)
 ADOBE_APPLICATION_JSON_URL = 'https://cdn-ffc.oobesaas.adobe.com/core/v3/applications'
 
 DRIVER_XML = '''<DriverInfo>
@@ -257,79 +305,386 @@ ADOBE_DL_HEADERS = {
     'User-Agent': 'Creative Cloud'
 }
 
+# Languages offered when an application.json doesn't list its SupportedLanguages
+INSTALL_LANGUAGES = ['en_US', 'en_GB', 'en_IL', 'en_AE', 'es_ES', 'es_MX', 'pt_BR', 'fr_FR', 'fr_CA', 'fr_MA', 'it_IT', 'de_DE', 'nl_NL',
+                     'ru_RU', 'uk_UA', 'zh_TW', 'zh_CN', 'ja_JP', 'ko_KR', 'pl_PL', 'hu_HU', 'cs_CZ', 'tr_TR', 'sv_SE', 'nb_NO', 'fi_FI', 'da_DK', 'ALL']
+
 ADOBE_CC_MAC_ICON_PATH = '/Library/Application Support/Adobe/Adobe Desktop Common/HDBox/Install.app/Contents/Resources/CreativeCloudInstaller.icns'
 MAC_VOLUME_ICON_PATH = '/System/Library/CoreServices/CoreTypes.bundle/Contents/Resources/CDAudioVolumeIcon.icns'
 
+# Files smaller than this are never split into segments
+SEGMENT_MIN_SIZE = 64 * 1024 * 1024
+SEGMENT_BLOCK_SIZE = 64 * 1024
 
-def r(url, headers=ADOBE_REQ_HEADERS):
-    """Retrieve a from a url as a string."""
-    req = session.get(url, headers=headers)
-    req.encoding = 'utf-8'
-    return req.text
+# Buffers of --bufferSize bytes in flight between a connection and its writer thread
+WRITE_QUEUE_DEPTH = 4
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+F_PREALLOCATE = 42
+FALLOC_FL_KEEP_SIZE = 1
 
+# Sizes of the fixed parts of zip records
+ZIP_EOCD_SIZE = 22
+ZIP64_LOCATOR_SIZE = 20
+ZIP_CENTRAL_HEADER_SIZE = 46
+ZIP_LOCAL_HEADER_SIZE = 30
 
-def get_products_xml(adobeurl):
-    """First stage of parsing the XML."""
-    print('Source URL is: ' + adobeurl)
-    return ET.fromstring(r(adobeurl))
+PART_SUFFIX = '.part'
+SEGMENTED_PART_SUFFIX = '.segments.part'
+# Lock file next to a package store entry, held by the process downloading it
+STORE_LOCK_SUFFIX = '.lock'
+JOURNAL_NAME = '.ccdl-journal.jsonl'
 
+# Answers worth retrying, everything else is returned to the caller as is
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_MAX_DELAY = 60
 
-def parse_products_xml(products_xml, urlVersion, allowedPlatforms):
-    """2nd stage of parsing the XML."""
-    if urlVersion == 6:
-        prefix = 'channels/'
-    else:
-        prefix = ''
-    cdn = products_xml.find(prefix + 'channel/cdn/secure').text
-    products = {}
-    parent_map = {c: p for p in products_xml.iter() for c in p}
-    for p in products_xml.findall(prefix + 'channel/products/product'):
-        sap = p.get('id')
-        hidden = parent_map[parent_map[p]].get('name') != 'ccm'
-        displayName = p.find('displayName').text
-        productVersion = p.get('version')
-        if not products.get(sap):
-            products[sap] = {
-                'hidden': hidden,
-                'displayName': displayName,
-                'sapCode': sap,
-                'versions': OrderedDict()
-            }
+# Seconds between the aggregate rate and completion time reports when the output is not a terminal
+PROGRESS_INTERVAL = 30
+# Seconds between refreshes of the progress bar and --progress jsonl events, the rate is taken over the last 10
+PROGRESS_REFRESH = 0.5
+PROGRESS_RATE_SAMPLES = 21
+PROGRESS_MODES = ('bar', 'jsonl', 'none')
 
-        for pf in p.findall('platforms/platform'):
-            baseVersion = pf.find('languageSet').get('baseVersion')
-            buildGuid = pf.find('languageSet').get('buildGuid')
-            appplatform = pf.get('id')
-            dependencies = list(pf.findall('languageSet/dependencies/dependency'))
-            if productVersion in products[sap]['versions']:
-                if products[sap]['versions'][productVersion]['apPlatform'] in allowedPlatforms:
-                    break # There's no single-arch binary if macuniversal is available
-
-            if sap == 'APRO':
-                baseVersion = productVersion
-                if urlVersion == 4 or urlVersion == 5:
-                    productVersion = pf.find('languageSet/nglLicensingInfo/appVersion').text
-                if urlVersion == 6:
-                    for b in products_xml.findall('builds/build'):
-                        if b.get("id") == sap and b.get("version") == baseVersion:
-                            productVersion = b.find('nglLicensingInfo/appVersion').text
-                            break
-                buildGuid = pf.find('languageSet/urls/manifestURL').text
-                # This is actually manifest URL
-
-            products[sap]['versions'][productVersion] = {
-                'sapCode': sap,
-                'baseVersion': baseVersion,
-                'productVersion': productVersion,
-                'apPlatform': appplatform,
-                'dependencies': [{
-                    'sapCode': d.find('sapCode').text, 'version': d.find('baseVersion').text
-                } for d in dependencies],
-                'buildGuid': buildGuid
+# The build daemon samples the download rate every 5 seconds, over the last minute
+DAEMON_SAMPLE_INTERVAL = 5
+DAEMON_RATE_SAMPLES = 13
+DAEMON_JOB_HISTORY = 1000
+DOWNLOAD_ORDERS = ('manifest', 'largest-first', 'smallest-first', 'core-first')
+
+DEFAULT_CACHE_DIR = os.path.expanduser('~/Library/Caches/adobe-packager')
+APPLICATION_JSON_CACHE_DIR = 'application_json'
+
+
+class DownloadError(Exception):
+    """A file could not be downloaded completely."""
+
+
+class CacheMiss(Exception):
+    """An offline run needs something that is not in the cache."""
+
+
+class JobError(ValueError):
+    """A build job can't be planned, the message says why."""
+
+
+class RangeNotSupported(DownloadError):
+    """The server ignored a Range request."""
+
+
+class IncompleteDownload(DownloadError):
+    """The connection ended before the whole body arrived."""
+
+
+# Failures that a new connection (and a Range continuation) may get past
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError, urllib3.exceptions.HTTPError, IncompleteDownload)
+
+
+class BuildJournal:
+    """Completed downloads of one installer, appended as JSON lines to its products folder."""
+
+    def __init__(self, products_dir):
+        self.products_dir = products_dir
+        self.path = os.path.join(products_dir, JOURNAL_NAME)
+        self.lock = threading.Lock()
+        self.done = {}
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Torn write from an interrupted run
+                    self.done[entry['file']] = entry['size']
+
+    def is_done(self, file_path):
+        """True if file_path was completed by an earlier run and is still intact."""
+        size = self.done.get(os.path.relpath(file_path, self.products_dir))
+        return size is not None and os.path.isfile(file_path) and os.path.getsize(file_path) == size
+
+    def add(self, file_path, size):
+        rel = os.path.relpath(file_path, self.products_dir)
+        with self.lock:
+            self.done[rel] = size
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'file': rel, 'size': size}) + '\n')
+
+
+class Metrics:
+    """Timing spans, counters and time-to-first-byte samples for --metrics-out, thread-safe.
+
+    Span seconds are summed over all threads, so spans of concurrent work can
+    add up to more than the wall time."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.spans = {}
+        self.counters = {}
+        self.ttfb = []
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                span = self.spans.setdefault(name, {'count': 0, 'seconds': 0.0, 'maxSeconds': 0.0})
+                span['count'] += 1
+                span['seconds'] += elapsed
+                span['maxSeconds'] = max(span['maxSeconds'], elapsed)
+
+    def add(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_ttfb(self, response):
+        """Record the time to the response headers of a request."""
+        with self.lock:
+            self.ttfb.append(response.elapsed.total_seconds())
+
+    def report(self):
+        with self.lock:
+            ttfb = sorted(self.ttfb)
+            report = {
+                'version': VERSION_STR,
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'wallSeconds': round(time.time() - self.started, 3),
+                'spans': {name: {k: round(v, 4) if isinstance(v, float) else v for k, v in span.items()}
+                          for name, span in self.spans.items()},
+                'counters': dict(self.counters),
+                'ttfb': {
+                    'count': len(ttfb),
+                    'meanSeconds': round(sum(ttfb) / len(ttfb), 4) if ttfb else None,
+                    'p50Seconds': round(ttfb[len(ttfb) // 2], 4) if ttfb else None,
+                    'p95Seconds': round(ttfb[int(len(ttfb) * 0.95)], 4) if ttfb else None,
+                    'maxSeconds': round(ttfb[-1], 4) if ttfb else None
+                }
             }
+        download = report['spans'].get('download_packages')
+        if download and download['seconds']:
+            report['downloadMBPerSecond'] = round(
+                report['counters'].get('downloadBytes', 0) / 1e6 / download['seconds'], 2)
+        return report
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+def timed(name):
+    """Decorator recording every call of a method as a span of self.metrics."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.span(name):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class RateLimiter:
+    """Token bucket shared by all download threads, capped by --max-rate and --rate-window.
+
+    Threads reserve their bytes up front and sleep off any deficit outside the
+    lock, so the aggregate rate holds however many downloads run in parallel."""
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.transferred = 0
+
+    def current_rate(self):
+        """Bytes per second allowed right now, 0 means unlimited."""
+        now = time.localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+        for start, end, rate in self.config.rate_window or []:
+            if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+                return rate
+        return self.config.max_rate
+
+    def consume(self, n):
+        rate = self.current_rate()
+        with self.lock:
+            self.transferred += n
+            if not rate:
+                return
+            now = time.monotonic()
+            # Allow at most one second of burst after an idle period
+            self.tokens = min(rate, self.tokens + (now - self.updated) * rate) - n
+            self.updated = now
+            wait = -self.tokens / rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+def write_file_atomic(path, data):
+    """Write bytes to path so readers never see a partial file."""
+    tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def read_product(p, hidden):
+    """Extract what parse_products_xml needs from one <product> element."""
+    sap = p.get('id')
+    product = {
+        'sapCode': sap,
+        'version': p.get('version'),
+        'hidden': hidden,
+        'displayName': p.find('displayName').text,
+        'platforms': []
+    }
+    for pf in p.findall('platforms/platform'):
+        languageSet = pf.find('languageSet')
+        platform_info = {
+            'id': pf.get('id'),
+            'baseVersion': languageSet.get('baseVersion'),
+            'buildGuid': languageSet.get('buildGuid'),
+            'dependencies': [{
+                'sapCode': d.find('sapCode').text, 'version': d.find('baseVersion').text
+            } for d in languageSet.findall('dependencies/dependency')]
+        }
+        if sap == 'APRO':
+            appVersion = languageSet.find('nglLicensingInfo/appVersion')
+            platform_info['appVersion'] = appVersion.text if appVersion is not None else None
+            platform_info['manifestURL'] = languageSet.find('urls/manifestURL').text
+        product['platforms'].append(platform_info)
+    return product
+
+
+def add_product(products, product, urlVersion, allowedPlatforms, builds):
+    """Merge the platforms of one product into the products dict."""
+    sap = product['sapCode']
+    productVersion = product['version']
+    versions = products[sap]['versions']
+    for pf in product['platforms']:
+        baseVersion = pf['baseVersion']
+        buildGuid = pf['buildGuid']
+        if productVersion in versions:
+            if versions[productVersion]['apPlatform'] in allowedPlatforms:
+                break # There's no single-arch binary if macuniversal is available
+
+        if sap == 'APRO':
+            baseVersion = productVersion
+            if urlVersion == 4 or urlVersion == 5:
+                productVersion = pf['appVersion']
+            if urlVersion == 6:
+                productVersion = builds.get((sap, baseVersion), productVersion)
+            buildGuid = pf['manifestURL']
+            # This is actually manifest URL
+
+        versions[productVersion] = {
+            'sapCode': sap,
+            'baseVersion': baseVersion,
+            'productVersion': productVersion,
+            'apPlatform': pf['id'],
+            'dependencies': pf['dependencies'],
+            'buildGuid': buildGuid
+        }
+
+
+def parse_products_xml(products_xml, urlVersion, allowedPlatforms):
+    """2nd stage of parsing the XML.
+
+    products_xml is the raw feed as bytes or a binary file. It is read with
+    iterparse and every product is dropped from the tree once it is parsed."""
+    if isinstance(products_xml, str):
+        products_xml = products_xml.encode('utf-8')
+    if isinstance(products_xml, bytes):
+        products_xml = io.BytesIO(products_xml)
+    # <products> sits in <channels><channel> on v6 and in <channel> before
+    depth = 4 if urlVersion == 6 else 3
+    cdn = None
+    products = {}
+    builds = {}
+    deferred = []
+    stack = []
+    for event, elem in ET.iterparse(products_xml, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            continue
+        stack.pop()
+        if elem.tag == 'product':
+            if len(stack) != depth or stack[-1].tag != 'products' or stack[-2].tag != 'channel':
+                continue
+            product = read_product(elem, stack[-2].get('name') != 'ccm')
+            stack[-1].remove(elem)
+            sap = product['sapCode']
+            if not products.get(sap):
+                products[sap] = {
+                    'hidden': product['hidden'],
+                    'displayName': product['displayName'],
+                    'sapCode': sap,
+                    'versions': OrderedDict()
+                }
+            if sap == 'APRO' and urlVersion == 6:
+                # The app version of APRO is in <builds>, which may come after the channels
+                deferred.append(product)
+            else:
+                add_product(products, product, urlVersion, allowedPlatforms, builds)
+        elif elem.tag == 'build' and len(stack) == 2 and stack[-1].tag == 'builds':
+            appVersion = elem.find('nglLicensingInfo/appVersion')
+            if appVersion is not None:
+                builds.setdefault((elem.get('id'), elem.get('version')), appVersion.text)
+            stack[-1].remove(elem)
+        elif (cdn is None and elem.tag == 'secure' and len(stack) == depth
+              and stack[-1].tag == 'cdn' and stack[-2].tag == 'channel'):
+            cdn = elem.text
+    for product in deferred:
+        add_product(products, product, urlVersion, allowedPlatforms, builds)
+    index_products(products, allowedPlatforms)
     return products, cdn
 
 
+def index_products(products, allowedPlatforms):
+    """Precompute the lookups used for listing and dependency resolution.
+
+    Every product gets 'byBaseVersion', the build to use for each baseVersion
+    (the first one for an allowed platform, else the first one), and
+    'latestVersion', the newest downloadable version or None."""
+    for product in products.values():
+        byBaseVersion = {}
+        latestVersion = None
+        for v in product['versions'].values():
+            allowed = v['apPlatform'] in allowedPlatforms
+            best = byBaseVersion.get(v['baseVersion'])
+            if best is None or (allowed and best['apPlatform'] not in allowedPlatforms):
+                byBaseVersion[v['baseVersion']] = v
+            if latestVersion is None and v['buildGuid'] and allowed:
+                latestVersion = v['productVersion']
+        product['byBaseVersion'] = byBaseVersion
+        product['latestVersion'] = latestVersion
+
+
+def resolve_dependencies(products, prodInfo):
+    """Return prodInfo and all its transitive dependencies as a list to download.
+
+    Each build is listed once, the product itself comes first."""
+    prods_to_download = [{'sapCode': prodInfo['sapCode'], 'version': prodInfo['productVersion'],
+                          'buildGuid': prodInfo['buildGuid']}]
+    seen = {(prodInfo['sapCode'], prodInfo['baseVersion'])}
+    pending = deque(prodInfo['dependencies'])
+    while pending:
+        d = pending.popleft()
+        if (d['sapCode'], d['version']) in seen:
+            continue
+        seen.add((d['sapCode'], d['version']))
+        depInfo = products.get(d['sapCode'], {}).get('byBaseVersion', {}).get(d['version'])
+        if not depInfo or not depInfo['buildGuid']:
+            print('[{}_{}] Dependency not found in products.xml, skipping'.format(d['sapCode'], d['version']))
+            continue
+        prods_to_download.append({'sapCode': d['sapCode'], 'version': d['version'],
+                                  'buildGuid': depInfo['buildGuid']})
+        pending.extend(depInfo['dependencies'])
+    return prods_to_download
+
+
 def questiony(question: str) -> bool:
     """Question prompt default Y."""
     reply = None
@@ -346,78 +701,272 @@ def questionn(question: str) -> bool:
     return (reply in ("y", "Y"))
 
 
-def get_application_json(buildGuid):
-    """Retrieve JSON."""
-    headers = ADOBE_REQ_HEADERS.copy()
-    headers['x-adobe-build-guid'] = buildGuid
-    return json.loads(r(ADOBE_APPLICATION_JSON_URL, headers))
-
-
-def get_download_path():
-    """Ask for desired download folder"""
-    if (args.destination):
-        print('\nUsing provided destination: ' + args.destination)
-        dest = args.destination
-    else:
-        print('\nPlease navigate to the desired downloads folder, or cancel to abort.')
-        p = Popen(['/usr/bin/osascript', '-e',
-                  'tell application (path to frontmost application as text)\nset _path to choose folder\nPOSIX path of _path\nend'], stdout=PIPE)
-        dest = p.communicate()[0].decode('utf-8').strip()
-        if (p.returncode != 0):
-            print('Exiting...')
-            exit()
-    return dest
-
-def download_file(url, product_dir, s, v, name=None):
-    """Download a file"""
-    if not name:
-        name = url.split('/')[-1].split('?')[0]
-    print('Url is: ' + url)
-    print('[{}_{}] Downloading {}'.format(s, v, name))
-    file_path = os.path.join(product_dir, name)
-    response = session.head(url, stream=True, headers=ADOBE_DL_HEADERS)
-    total_size_in_bytes = int(
-        response.headers.get('content-length', 0))
-    if (args.skipExisting and os.path.isfile(file_path) and os.path.getsize(file_path) == total_size_in_bytes):
-        print('[{}_{}] {} already exists, skipping'.format(s, v, name))
-    else:
-        response = session.get(
-            url, stream=True, headers=ADOBE_REQ_HEADERS)
-        total_size_in_bytes = int(
-            response.headers.get('content-length', 0))
-        block_size = 1024  # 1 Kibibyte
-        progress_bar = tqdm(total=total_size_in_bytes,
-                            unit='iB', unit_scale=True)
-        with open(file_path, 'wb') as file:
-            for data in response.iter_content(block_size):
-                progress_bar.update(len(data))
-                file.write(data)
-        progress_bar.close()
-        if total_size_in_bytes != 0 and progress_bar.n != total_size_in_bytes:
-            print("ERROR, something went wrong")
-
-
-def download_APRO(appInfo, cdn):
-    """Download APRO"""
-    manifest = get_products_xml(cdn + appInfo['buildGuid'])
-    downloadURL = manifest.find('asset_list/asset/asset_path').text
-    dest = get_download_path()
-    sapCode = appInfo['sapCode']
-    version = appInfo['productVersion']
-    name = 'Intall {}_{}_{}.dmg'.format(sapCode, version, appInfo['apPlatform'])
-    print('')
-    print('sapCode: ' + sapCode)
-    print('version: ' + version)
-    print('installLanguage: ' + 'ALL')
-    print('dest: ' + os.path.join(dest, name))
+def preallocate(fd, size):
+    """Reserve disk blocks for size bytes without changing the file size.
 
-    print('\nDownloading...\n')
+    The size of a .part file has to stay the number of bytes written for
+    resuming. Best effort, file systems without support are left alone."""
+    try:
+        if sys.platform == 'darwin':
+            missing = size - os.fstat(fd).st_size
+            if missing > 0:
+                # fstore_t: F_ALLOCATEALL, F_PEOFPOSMODE, offset, length, bytes allocated
+                fcntl.fcntl(fd, F_PREALLOCATE, struct.pack('Iiqqq', 4, 3, 0, missing, 0))
+        elif sys.platform.startswith('linux') and size > 0:
+            libc = ctypes.CDLL(None, use_errno=True)
+            libc.fallocate(fd, FALLOC_FL_KEEP_SIZE, ctypes.c_longlong(0), ctypes.c_longlong(size))
+    except (OSError, AttributeError):
+        pass
+
+
+class WritePipeline:
+    """Copy response bodies into a file descriptor through a writer thread.
+
+    The connection is read into a few reusable buffers of buffer_size bytes,
+    which a bounded queue hands to the writer, so a slow disk doesn't stall the
+    socket. offset is the position after the last byte received."""
+
+    def __init__(self, fd, offset, buffer_size, rate_limiter, metrics):
+        self.fd = fd
+        self.offset = offset
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self.free = queue.Queue()
+        for _ in range(WRITE_QUEUE_DEPTH):
+            self.free.put(bytearray(buffer_size))
+        self.pending = queue.Queue(maxsize=WRITE_QUEUE_DEPTH)
+        self.error = None
+
+    def write(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            buf, n, position = item
+            if self.error is None:
+                try:
+                    view = memoryview(buf)[:n]
+                    while view:
+                        written = os.pwrite(self.fd, view, position)
+                        view = view[written:]
+                        position += written
+                except OSError as e:
+                    self.error = e
+            self.free.put(buf)
+
+    def copy(self, response, end=None, progress=None):
+        """Write the body of a streamed response at offset, end is the last byte it may reach.
+
+        Every buffer read is added to progress, a ProgressFile, if given."""
+        raw = response.raw
+        raw.decode_content = True
+        writer = threading.Thread(target=self.write, daemon=True)
+        writer.start()
+        start = position = self.offset
+        try:
+            while self.error is None:
+                buf = self.free.get()
+                try:
+                    n = raw.readinto(buf)
+                except BaseException:
+                    # The pipeline is used again for the retry, it must not lose buffers
+                    self.free.put(buf)
+                    raise
+                if not n:
+                    self.free.put(buf)
+                    break
+                if end is not None and position + n > end + 1:
+                    self.free.put(buf)
+                    raise DownloadError('server sent more than the requested range')
+                self.pending.put((buf, n, position))
+                position += n
+                if progress is not None:
+                    progress.add(n)
+                self.rate_limiter.consume(n)
+        finally:
+            # Everything received is on disk when copy returns or raises
+            self.pending.put(None)
+            writer.join()
+            self.offset = position
+            self.metrics.add('downloadBytes', position - start)
+        if self.error:
+            raise self.error
+
+
+class ProgressFile:
+    """Byte counter of one file being downloaded, see Progress.
+
+    Every buffer read only adds to it, segments of the file share it."""
+
+    def __init__(self, sapCode, version, name, size):
+        self.sapCode = sapCode
+        self.version = version
+        self.name = name
+        self.size = size
+        self.done = 0
+        self.received = 0
+        self.lock = threading.Lock()
+
+    def reset(self, size, offset):
+        """Start over at offset of a file of size bytes, after a retry or once the size is known."""
+        with self.lock:
+            self.size = size
+            self.done = offset
+
+    def add(self, n):
+        with self.lock:
+            self.done += n
+            self.received += n
+
+
+class Progress:
+    """Aggregate progress of a set of downloads.
+
+    Downloads only count bytes in their ProgressFile. A reporter thread sums
+    the counters every PROGRESS_REFRESH seconds into one bar with the total
+    bytes, rate, completion time and active files ('bar', a line every
+    PROGRESS_INTERVAL seconds instead when stderr is not a terminal), into
+    JSON lines on standard output ('jsonl') or nowhere ('none')."""
+
+    def __init__(self, mode, files, total):
+        self.mode = mode
+        self.files = files
+        self.total = total
+        self.lock = threading.Lock()
+        self.active = []
+        self.settled = 0
+        self.received = 0
+        self.finished = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.samples = deque([(self.started, 0)], maxlen=PROGRESS_RATE_SAMPLES)
+        self.stop = threading.Event()
+        self.thread = None
+        self.bar = None
+        self.reported = self.started
+
+    def emit(self, event, **fields):
+        """Write one --progress jsonl event."""
+        if self.mode != 'jsonl':
+            return
+        line = json.dumps(dict(event=event, time=round(time.time(), 3), **fields), separators=(',', ':'))
+        with self.lock:
+            sys.__stdout__.write(line + '\n')
+            sys.__stdout__.flush()
+
+    def write(self, message):
+        """Print a message without breaking the bar or the JSON lines on standard output."""
+        if self.mode == 'jsonl':
+            print(message, file=sys.stderr)
+        elif self.bar is not None:
+            tqdm.write(message)
+        else:
+            print(message)
+
+    def start(self):
+        self.emit('start', files=self.files, totalBytes=self.total)
+        if self.mode == 'none':
+            return self
+        if self.mode == 'bar' and sys.stderr.isatty():
+            self.bar = tqdm(total=self.total or None, desc='Downloading', unit='B', unit_scale=True, unit_divisor=1024,
+                            bar_format='{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt}{unit}{postfix}')
+        self.thread = threading.Thread(target=self.report, daemon=True)
+        self.thread.start()
+        return self
+
+    def open(self, sapCode, version, name, size):
+        """Count a file that starts downloading."""
+        f = ProgressFile(sapCode, version, name, size)
+        with self.lock:
+            self.active.append(f)
+        self.emit('file', sapCode=sapCode, version=version, name=name, status='downloading', bytes=size)
+        return f
+
+    def close(self, f):
+        with self.lock:
+            self.active.remove(f)
+            self.received += f.received
+
+    def finish(self, sapCode, version, name, size, status, error=None):
+        """Account for a file that is 'done', 'skipped' (already there) or 'failed'."""
+        with self.lock:
+            self.settled += size or 0
+            self.finished += 1
+            if status == 'failed':
+                self.failed += 1
+        fields = {'error': error} if error else {}
+        self.emit('file', sapCode=sapCode, version=version, name=name, status=status, bytes=size, **fields)
+
+    def snapshot(self):
+        """Sum the counters, returns (bytes done, bytes per second, seconds left or None, active files)."""
+        now = time.monotonic()
+        with self.lock:
+            active = list(self.active)
+            done = self.settled
+            received = self.received
+        for f in active:
+            done += f.done
+            received += f.received
+        self.samples.append((now, received))
+        first_time, first_received = self.samples[0]
+        rate = (received - first_received) / (now - first_time) if now > first_time else 0
+        left = None
+        if self.total and rate:
+            left = max(0, self.total - done) / rate
+        return done, rate, left, active
+
+    def report(self):
+        while not self.stop.wait(PROGRESS_REFRESH):
+            self.show(*self.snapshot())
+
+    def show(self, done, rate, left, active):
+        if self.mode == 'jsonl':
+            self.emit('progress', bytes=done, totalBytes=self.total, bytesPerSecond=round(rate),
+                      secondsLeft=round(left) if left is not None else None, filesDone=self.finished,
+                      files=self.files, active=[f.name for f in active])
+        elif self.bar is not None:
+            # Sizes in application.json can be off, the bar stops at the total
+            self.bar.update((min(done, self.total) if self.total else done) - self.bar.n)
+            self.bar.set_postfix_str('{}/s, {}{} active'.format(
+                format_size(int(rate)), 'done at {}, '.format(format_eta(left)) if left is not None else '', len(active)),
+                refresh=True)
+        elif time.monotonic() - self.reported >= PROGRESS_INTERVAL:
+            self.reported = time.monotonic()
+            if left is not None:
+                print('\nDownloaded {} of {} at {}/s, expected to finish at {}, {} files active\n'.format(
+                    format_size(done), format_size(self.total), format_size(int(rate)), format_eta(left), len(active)))
+
+    def end(self):
+        """Stop reporting and show the final totals."""
+        self.stop.set()
+        if self.thread:
+            self.thread.join()
+        done, _, _, _ = self.snapshot()
+        if self.bar is not None:
+            self.bar.update((min(done, self.total) if self.total else done) - self.bar.n)
+            self.bar.close()
+        seconds = time.monotonic() - self.started
+        self.emit('end', bytes=done, receivedBytes=self.received, seconds=round(seconds, 3),
+                  filesDone=self.finished, failed=self.failed)
+
+
+def link_file(src, dst):
+    """Place src at dst as a hardlink, a copy-on-write clone or, failing both, a copy."""
+    tmp_path = dst + '.link.tmp'
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        # Store on another volume, clone on APFS or copy
+        if sys.platform != 'darwin' or Popen(['/bin/cp', '-c', src, tmp_path]).wait() != 0:
+            shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+    os.utime(src)  # Most recently used for prune_package_store
 
-    print('[{}_{}] Selected 1 package'.format(sapCode, version))
-    download_file(downloadURL, dest, sapCode, version, name)
 
-    print('\nInstaller successfully downloaded. Open ' + os.path.join(dest, name) + ' and run Acrobat/Acrobat DC Installer.pkg to install.')
-    return
+def format_eta(seconds):
+    return time.strftime('%H:%M:%S', time.localtime(time.time() + seconds))
 
 
 def show_version():
@@ -428,95 +977,2246 @@ def show_version():
           '=' * (31 - len(VERSION_STR) - ye)))
 
 
-def get_products():
-    if (args.ignoreNoCreativeCloud):
+def parse_url_version(val):
+    """Return 4, 5 or 6 for a URL version such as 'v6', 'all' for every feed, None if it is invalid."""
+    return {'v4': 4, '4': 4, 'v5': 5, '5': 5, 'v6': 6, '6': 6, 'all': 'all'}.get(val.lower())
+
+
+def parse_arch(val):
+    """Return True for Apple Silicon, False for Intel and None if val is not an architecture."""
+    if val.lower() == 'x86_64' or val.lower() == 'x64' or val.lower() == 'intel':
+        return False
+    if val.lower() == 'arm64' or val.lower() == 'arm' or val.lower() == 'm1':
+        return True
+    return None
+
+
+def parse_archs(val):
+    """Return the architectures (see parse_arch) of an --arch value, both of them for 'all', None if it is invalid."""
+    if val.lower() == 'all':
+        return [False, True]
+    ism1 = parse_arch(val)
+    return None if ism1 is None else [ism1]
+
+
+def parse_size(val):
+    """Parse a byte count such as 512K, 50M or 1.5G."""
+    match = re.fullmatch(r'([\d.]+)([KMG]?)B?', val.upper())
+    if not match:
+        raise ValueError('Invalid size: ' + val)
+    return int(float(match.group(1)) * {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}[match.group(2)])
+
+
+def parse_rate(val):
+    """Parse a byte rate such as 500K, 50M or 1.5G per second, 0 means unlimited."""
+    return parse_size(val)
+
+
+def parse_rate_window(val):
+    """Parse HH:MM-HH:MM=RATE into (start minute, end minute, bytes per second)."""
+    match = re.fullmatch(r'(\d\d?):(\d\d)-(\d\d?):(\d\d)=(.+)', val)
+    if not match:
+        raise ValueError('Invalid rate window: ' + val)
+    h1, m1, h2, m2 = (int(g) for g in match.groups()[:4])
+    return h1 * 60 + m1, h2 * 60 + m2, parse_rate(match.group(5))
+
+
+def get_allowed_platforms(ism1):
+    allowedPlatforms = ['macuniversal']
+    if ism1:
+        allowedPlatforms.append('macarm64')
+    else:
+        allowedPlatforms.append('osx10-64')
+        allowedPlatforms.append('osx10')
+    return allowedPlatforms
+
+
+def merge_catalogs(catalogs, allowedPlatforms):
+    """Merge the products of several feeds, given as (urlVersion, products, cdn), into one catalog.
+
+    Newer feeds come first. A version found in several feeds with the same
+    buildGuid is listed once, each version records the feeds it is in
+    ('feeds') and the CDN of the first of them ('cdn')."""
+    merged = {}
+    for urlVersion, products, cdn in sorted(catalogs, key=lambda c: c[0], reverse=True):
+        for sap, product in products.items():
+            target = merged.setdefault(sap, {
+                'hidden': product['hidden'],
+                'displayName': product['displayName'],
+                'sapCode': sap,
+                'versions': OrderedDict()
+            })
+            target['hidden'] = target['hidden'] and product['hidden']
+            for version, prodInfo in product['versions'].items():
+                existing = target['versions'].get(version)
+                if existing is None:
+                    prodInfo['feeds'] = [urlVersion]
+                    prodInfo['cdn'] = cdn
+                    target['versions'][version] = prodInfo
+                elif existing['buildGuid'] == prodInfo['buildGuid']:
+                    existing['feeds'].append(urlVersion)
+    index_products(merged, allowedPlatforms)
+    return merged
+
+
+def format_language(val):
+    """Fix the case of a language code, e.g. en_us -> en_US and all -> ALL."""
+    if len(val) == 5:
+        val = val[0:2].lower() + val[2] + val[3:5].upper()
+    elif len(val) == 3:
+        val = val.upper()
+    return val
+
+
+def platform_arch(apPlatform):
+    """Architecture an installer for apPlatform runs on, None for universal installers."""
+    return {'macarm64': 'arm64', 'osx10-64': 'x64', 'osx10': 'x64'}.get(apPlatform)
+
+
+def plan_installer(products, cdn, prodInfo, installLanguage, oslang, dest, previous=None):
+    """Describe one installer: where it is created and which builds it contains.
+
+    Unchanged packages are taken from the previous installer app, if given."""
+    install_app_name = 'Install {}_{}-{}-{}.app'.format(
+        prodInfo['sapCode'], prodInfo['productVersion'], installLanguage, prodInfo['apPlatform'])
+    install_app_path = os.path.join(dest, install_app_name)
+    return {
+        'displayName': products[prodInfo['sapCode']]['displayName'],
+        'prodInfo': prodInfo,
+        'cdn': cdn,
+        'installLanguage': installLanguage,
+        'oslang': oslang,
+        'arch': platform_arch(prodInfo['apPlatform']),
+        'install_app_name': install_app_name,
+        'install_app_path': install_app_path,
+        'products_dir': os.path.join(install_app_path, 'Contents', 'Resources', 'products'),
+        'prods_to_download': resolve_dependencies(products, prodInfo),
+        'from': previous
+    }
+
+
+class ConditionError(ValueError):
+    """A package Condition could not be parsed."""
+
+
+CONDITION_TOKEN = re.compile(r'\s*(\[[^\]]*\]|"[^"]*"|\'[^\']*\'|&&|\|\||==|!=|>=|<=|=|<|>|!|\(|\)|[^\s()!=<>&|\[\]"\']+)')
+
+# Condition variables we can answer, by lowercased name. Anything else is unknown.
+CONDITION_VARIABLES = {
+    'installlanguage': 'installLanguage',
+    'osarchitecture': 'arch',
+    'osarch': 'arch',
+    'processorarchitecture': 'arch',
+    'osversion': 'osVersion',
+    'osprocessorfamily': 'processorFamily',
+}
+
+
+def condition_tokens(condition):
+    tokens = []
+    pos = 0
+    condition = condition.strip()
+    while pos < len(condition):
+        match = CONDITION_TOKEN.match(condition, pos)
+        if not match:
+            raise ConditionError('Unexpected {!r} in condition {!r}'.format(condition[pos:], condition))
+        tokens.append(match.group(1))
+        pos = match.end()
+    return tokens
+
+
+def condition_value(a):
+    """Normalise a value for comparison: versions as tuples, architectures through parse_arch."""
+    if re.fullmatch(r'\d+(\.\d+)*', a):
+        parts = [int(p) for p in a.split('.')]
+        while len(parts) > 1 and parts[-1] == 0:
+            parts.pop()
+        return tuple(parts)
+    arch = parse_arch(a)
+    if arch is not None:
+        return 'arm64' if arch else 'x64'
+    return a.lower()
+
+
+def compare_condition(op, a, b):
+    if a is None or b is None:
+        return None
+    a, b = condition_value(a), condition_value(b)
+    if op in ('==', '='):
+        return a == b
+    if op == '!=':
+        return a != b
+    if type(a) != type(b):
+        return None
+    return {'<': a < b, '<=': a <= b, '>': a > b, '>=': a >= b}[op]
+
+
+def all_of(values):
+    """Three-valued AND, None means unknown."""
+    return False if False in values else None if None in values else True
+
+
+def any_of(values):
+    """Three-valued OR, None means unknown."""
+    return True if True in values else None if None in values else False
+
+
+@functools.lru_cache(maxsize=None)
+def compile_condition(condition):
+    """Compile an application.json Condition into a function of the target environment.
+
+    The function returns True or False, or None when the condition depends on
+    something unknown about the target (such as its OS version)."""
+    tokens = condition_tokens(condition)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        pos += 1
+        return tokens[pos - 1]
+
+    def operand():
+        token = take()
+        if token.startswith('['):
+            name = CONDITION_VARIABLES.get(token[1:-1].strip().lower())
+            return lambda env: env.get(name) if name else None
+        if token[0] in '"\'':
+            token = token[1:-1]
+        elif token in ('(', ')', '&&', '||', '!', '==', '!=', '>=', '<=', '=', '<', '>'):
+            raise ConditionError('Unexpected {!r} in condition {!r}'.format(token, condition))
+        return lambda env: token
+
+    def atom():
+        if peek() == '(':
+            take()
+            node = disjunction()
+            if peek() != ')':
+                raise ConditionError('Missing ) in condition {!r}'.format(condition))
+            take()
+            return node
+        left = operand()
+        if peek() not in ('==', '!=', '>=', '<=', '=', '<', '>'):
+            return lambda env: {'true': True, 'false': False}.get(str(left(env)).lower())
+        op = take()
+        if peek() is None:
+            raise ConditionError('Missing operand in condition {!r}'.format(condition))
+        right = operand()
+        return lambda env: compare_condition(op, left(env), right(env))
+
+    def negation():
+        if peek() in ('!', 'not', 'NOT'):
+            take()
+            node = negation()
+            return lambda env: None if node(env) is None else not node(env)
+        return atom()
+
+    def conjunction():
+        nodes = [negation()]
+        while peek() in ('&&', 'and', 'AND'):
+            take()
+            nodes.append(negation())
+        return nodes[0] if len(nodes) == 1 else lambda env: all_of([n(env) for n in nodes])
+
+    def disjunction():
+        nodes = [conjunction()]
+        while peek() in ('||', 'or', 'OR'):
+            take()
+            nodes.append(conjunction())
+        return nodes[0] if len(nodes) == 1 else lambda env: any_of([n(env) for n in nodes])
+
+    if not tokens:
+        raise ConditionError('Empty condition')
+    node = disjunction()
+    if pos != len(tokens):
+        raise ConditionError('Unexpected {!r} in condition {!r}'.format(tokens[pos], condition))
+    return node
+
+
+def condition_matches(condition, envs):
+    """Whether a package with condition can be used in any of the target environments.
+
+    Unknown answers and unparseable conditions keep the package."""
+    try:
+        evaluate = compile_condition(condition)
+    except ConditionError as e:
+        print('Keeping package, {}'.format(e))
+        return True
+    return any(evaluate(env) is not False for env in envs)
+
+
+def select_packages(app_json, installLanguage, oslang, arch=None, osVersion=None):
+    """Return the core packages and the non-core packages whose Condition matches the installer.
+
+    The installer is built for installLanguage, the OS language, arch (None
+    for universal installers) and osVersion (None for any). Core packages are
+    always kept."""
+    languages = [None] if installLanguage == 'ALL' else [installLanguage, oslang]
+    envs = [{'installLanguage': lang, 'arch': arch, 'osVersion': osVersion, 'processorFamily': '64-bit'}
+            for lang in languages]
+    core = []
+    noncore = []
+    for pkg in app_json['Packages']['Package']:
+        if pkg.get('Type') and pkg['Type'] == 'core':
+            core.append(pkg)
+        elif 'Condition' not in pkg or not pkg['Condition'].strip() or condition_matches(pkg['Condition'], envs):
+            noncore.append(pkg)
+    return core, noncore
+
+
+def create_installer_app(install_app_path):
+    """Compile the installer applet and give it the Creative Cloud icon."""
+    with Popen(['/usr/bin/osacompile', '-l', 'JavaScript', '-o', install_app_path], stdin=PIPE) as p:
+        p.communicate(INSTALL_APP_APPLE_SCRIPT.encode('utf-8'))
+
+    if os.path.isfile(ADOBE_CC_MAC_ICON_PATH):
+        icon_path = ADOBE_CC_MAC_ICON_PATH
+    else:
+        icon_path = MAC_VOLUME_ICON_PATH
+    shutil.copyfile(icon_path, os.path.join(install_app_path,
+                    'Contents', 'Resources', 'applet.icns'))
+
+
+def previous_packages(app_path):
+    """Index the complete packages of an existing installer by their CDN Path and DownloadSize."""
+    products_dir = os.path.join(app_path, 'Contents', 'Resources', 'products')
+    previous = {}
+    for sapCode in sorted(os.listdir(products_dir)):
+        app_json_path = os.path.join(products_dir, sapCode, 'application.json')
+        if not os.path.isfile(app_json_path):
+            continue
+        with open(app_json_path) as f:
+            app_json = json.load(f)
+        for pkg in app_json.get('Packages', {}).get('Package', []):
+            size = pkg.get('DownloadSize')
+            file_path = os.path.join(products_dir, sapCode, pkg['Path'].split('/')[-1])
+            if not size or not os.path.isfile(file_path) or os.path.getsize(file_path) != size:
+                continue
+            previous[(pkg['Path'], size)] = file_path
+    return previous
+
+
+def previous_package(previous, pkg):
+    """Location of pkg in a previous installer, if the same zip is there."""
+    return previous.get((pkg['Path'], pkg.get('DownloadSize')))
+
+
+def zip64_extra(extra, values):
+    """Replace the 0xFFFFFFFF values (uncompressed size, compressed size, local header offset) from a zip64 extra field."""
+    pos = 0
+    while pos + 4 <= len(extra):
+        header_id, data_size = struct.unpack_from('<HH', extra, pos)
+        if header_id == 1:
+            data = extra[pos + 4:pos + 4 + data_size]
+            values = list(values)
+            field = 0
+            for i, value in enumerate(values):
+                if value == 0xFFFFFFFF and field + 8 <= len(data):
+                    values[i], = struct.unpack_from('<Q', data, field)
+                    field += 8
+            return values
+        pos += 4 + data_size
+    return values
+
+
+def check_zip_directory(m):
+    """Check the end of central directory record and central directory of a zip in m.
+
+    Every entry must point at a local file header whose data ends before
+    the central directory. Returns None or what is wrong."""
+    eocd = m.rfind(b'PK\x05\x06', max(0, len(m) - ZIP_EOCD_SIZE - 0xFFFF))
+    if eocd < 0:
+        return 'no end of central directory record, the file is truncated'
+    _, disk, cd_disk, _, entries, cd_size, cd_offset, comment_len = struct.unpack_from('<IHHHHIIH', m, eocd)
+    if eocd + ZIP_EOCD_SIZE + comment_len > len(m):
+        return 'end of central directory record is truncated'
+    if disk or cd_disk:
+        return 'multi-disk zips are not supported'
+    cd_end = eocd
+    if entries == 0xFFFF or cd_size == 0xFFFFFFFF or cd_offset == 0xFFFFFFFF:
+        locator = eocd - ZIP64_LOCATOR_SIZE
+        if locator < 0 or m[locator:locator + 4] != b'PK\x06\x07':
+            return 'zip64 end of central directory locator missing'
+        cd_end, = struct.unpack_from('<Q', m, locator + 8)
+        if m[cd_end:cd_end + 4] != b'PK\x06\x06':
+            return 'zip64 end of central directory record missing'
+        entries, cd_size, cd_offset = struct.unpack_from('<QQQ', m, cd_end + 32)
+    if cd_offset + cd_size != cd_end:
+        return 'central directory at {} of {} bytes does not end at {}'.format(cd_offset, cd_size, cd_end)
+
+    pos = cd_offset
+    for i in range(entries):
+        if pos + ZIP_CENTRAL_HEADER_SIZE > cd_end or m[pos:pos + 4] != b'PK\x01\x02':
+            return 'central directory entry {} of {} is damaged'.format(i + 1, entries)
+        (compressed, uncompressed, name_len, extra_len, comment_len, _, _, _,
+         local) = struct.unpack_from('<IIHHHHHII', m, pos + 20)
+        name = m[pos + ZIP_CENTRAL_HEADER_SIZE:pos + ZIP_CENTRAL_HEADER_SIZE + name_len].decode('utf-8', 'replace')
+        extra = m[pos + ZIP_CENTRAL_HEADER_SIZE + name_len:pos + ZIP_CENTRAL_HEADER_SIZE + name_len + extra_len]
+        uncompressed, compressed, local = zip64_extra(extra, (uncompressed, compressed, local))
+        if local + ZIP_LOCAL_HEADER_SIZE > cd_offset or m[local:local + 4] != b'PK\x03\x04':
+            return 'local header of {} is missing'.format(name)
+        local_name_len, local_extra_len = struct.unpack_from('<HH', m, local + 26)
+        if local + ZIP_LOCAL_HEADER_SIZE + local_name_len + local_extra_len + compressed > cd_offset:
+            return 'data of {} runs into the central directory'.format(name)
+        pos += ZIP_CENTRAL_HEADER_SIZE + name_len + extra_len + comment_len
+    if pos != cd_end:
+        return 'central directory holds more than {} entries'.format(entries)
+    return None
+
+
+def verify_package(path, size=None, full=False):
+    """Check a downloaded package zip, returns None or what is wrong with it.
+
+    The size is compared with size (DownloadSize) and the zip directory is
+    read through mmap, which only touches the end of the file and one page
+    per member. full also decompresses every member and checks its CRC-32."""
+    try:
+        actual = os.path.getsize(path)
+        if size and actual != size:
+            return '{} bytes instead of {}'.format(actual, size)
+        if actual < ZIP_EOCD_SIZE:
+            return 'too small for a zip'
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            error = check_zip_directory(m)
+        if error or not full:
+            return error
+        with zipfile.ZipFile(path) as z:
+            bad = z.testzip()
+        return 'CRC-32 mismatch in {}'.format(bad) if bad else None
+    except (OSError, ValueError, EOFError, struct.error, zipfile.BadZipFile, zlib.error) as e:
+        return str(e) or type(e).__name__
+
+
+def installer_packages(app_path, osVersion=None):
+    """The package zips of an installer as (path, DownloadSize), its leftover .part files and its missing packages.
+
+    The packages it should have are selected from its application.json files
+    like select_packages does when building, for the language and platform
+    in driver.xml and osVersion. Without driver.xml only core packages are
+    expected."""
+    products_dir = os.path.join(app_path, 'Contents', 'Resources', 'products')
+    installLanguage = arch = None
+    driver_path = os.path.join(products_dir, 'driver.xml')
+    if os.path.isfile(driver_path):
+        driver = ET.parse(driver_path).getroot()
+        installLanguage = driver.findtext('RequestInfo/InstallLanguage')
+        arch = platform_arch(driver.findtext('ProductInfo/Platform') or '')
+    packages = []
+    partial = []
+    missing = []
+    for sapCode in sorted(os.listdir(products_dir)):
+        product_dir = os.path.join(products_dir, sapCode)
+        if not os.path.isdir(product_dir):
+            continue
+        parts = [os.path.join(product_dir, f) for f in sorted(os.listdir(product_dir)) if f.endswith(PART_SUFFIX)]
+        partial.extend(parts)
+        app_json_path = os.path.join(product_dir, 'application.json')
+        if not os.path.isfile(app_json_path):
+            continue
+        with open(app_json_path) as f:
+            app_json = json.load(f)
+        if installLanguage:
+            core, noncore = select_packages(app_json, installLanguage, installLanguage, arch, osVersion)
+        else:
+            core, noncore = select_packages(app_json, 'ALL', None, arch, osVersion)
+            noncore = []
+        expected = [pkg['Path'] for pkg in core + noncore]
+        for pkg in app_json.get('Packages', {}).get('Package', []):
+            file_path = os.path.join(product_dir, pkg['Path'].split('/')[-1])
+            if os.path.isfile(file_path):
+                packages.append((file_path, pkg.get('DownloadSize')))
+            elif pkg['Path'] in expected and not any(part.startswith(file_path + '.') for part in parts):
+                missing.append(file_path)
+    return packages, partial, missing
+
+
+def task_path(task):
+    return os.path.join(task['product_dir'], task['url'].split('/')[-1].split('?')[0])
+
+
+def write_driver_xml(build):
+    prodInfo = build['prodInfo']
+    driver = DRIVER_XML.format(
+        name=build['displayName'],
+        sapCode=prodInfo['sapCode'],
+        version=prodInfo['productVersion'],
+        installPlatform=prodInfo['apPlatform'],
+        dependencies='\n'.join([DRIVER_XML_DEPENDENCY.format(
+            sapCode=d['sapCode'],
+            version=d['version']
+        ) for d in prodInfo['dependencies']]),
+        language=build['installLanguage']
+    )
+
+    with open(os.path.join(build['products_dir'], 'driver.xml'), 'w') as f:
+        f.write(driver)
+        f.close()
+
+
+class ArchiveWriter:
+    """Stream finished installer files into one tar archive while the build runs.
+
+    Installers are built in a staging folder (root) and every file is added
+    as soon as it is complete, while it is still in the page cache. zstd and
+    gzip run as separate processes, so compression gets its own core."""
+
+    def __init__(self, path, compression):
+        self.path = path
+        self.root = tempfile.mkdtemp(prefix='ccdl-archive-',
+                                     dir=None if path == '-' else os.path.dirname(os.path.abspath(path)))
+        if path == '-':
+            self.out = sys.__stdout__.buffer
+        else:
+            self.out = open(path + PART_SUFFIX, 'wb')
+        self.compressor = None
+        stream = self.out
+        if compression:
+            command = {'zst': ['zstd', '-q', '-T0', '-c'],
+                       'gz': ['pigz', '-c'] if shutil.which('pigz') else ['gzip', '-c']}[compression]
+            self.compressor = Popen(command, stdin=PIPE, stdout=self.out)
+            stream = self.compressor.stdin
+        self.tar = tarfile.open(fileobj=stream, mode='w|', format=tarfile.PAX_FORMAT)
+        self.added = set()
+        self.lock = threading.Lock()
+
+    def add(self, path):
+        """Add a file or folder (without its contents) once, named relative to root."""
+        with self.lock:
+            if path in self.added:
+                return
+            self.added.add(path)
+            # Files linked into several installers are stored once, as tar hardlinks
+            self.tar.add(path, os.path.relpath(path, self.root), recursive=False)
+
+    def add_tree(self, top):
+        """Add everything below top that has not been added yet."""
+        self.add(top)
+        for root, dirs, files in os.walk(top):
+            dirs.sort()
+            for name in dirs:
+                self.add(os.path.join(root, name))
+            for name in sorted(files):
+                if name != JOURNAL_NAME and not name.endswith(PART_SUFFIX):
+                    self.add(os.path.join(root, name))
+
+    def close(self, complete=True):
+        try:
+            self.tar.close()
+            if self.compressor:
+                self.compressor.stdin.close()
+                if self.compressor.wait() != 0:
+                    complete = False
+                    print('Compressing {} failed'.format(self.path))
+        finally:
+            if self.path != '-':
+                self.out.close()
+                if complete:
+                    os.replace(self.path + PART_SUFFIX, self.path)
+                    print('\nArchive written to {}'.format(self.path))
+                else:
+                    os.remove(self.path + PART_SUFFIX)
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+def archive_compression(path, compression=None):
+    """Compression of an --archive path, given explicitly or from its extension."""
+    if compression:
+        return None if compression == 'none' else compression
+    if path.endswith(('.tar.zst', '.tzst')):
+        return 'zst'
+    if path.endswith(('.tar.gz', '.tgz')):
+        return 'gz'
+    return None
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return '{:.1f} {}'.format(size, unit) if unit != 'B' else '{} B'.format(size)
+        size /= 1024
+    return '{:.2f} TB'.format(size)
+
+
+def load_batch_manifest(path):
+    """Read a batch manifest, either a list of jobs or an object with defaults:
+
+    {"urlVersion": "v6", "destination": "/Volumes/Installers",
+     "jobs": [{"sapCode": "PHSP", "version": "25.0", "installLanguage": "en_US", "arch": "arm64"}]}
+
+    A job's "from" names a previous installer to take unchanged packages from,
+    an "arch" of "all" builds one for each architecture."""
+    with open(path) as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {'jobs': manifest}
+    return manifest
+
+
+class Transport:
+    """The HTTP session, request headers and rate limit of a Packager.
+
+    Every build and download thread shares the session, so its connection
+    pools are sized for --jobs times --segments connections per host."""
+
+    def __init__(self, config, metrics):
+        self.config = config
+        self.metrics = metrics
+        self.headers = dict(ADOBE_REQ_HEADERS)
+        if config.Auth:
+            self.headers['Authorization'] = config.Auth
+        self.rate_limiter = RateLimiter(config)
+        self.session = requests.sessions.Session()
+        # Retries are done by request(), the adapter itself never retries
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max(config.jobs * config.segments, 10), max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def backoff(self, failures, what, error):
+        """Sleep before retry number failures of what, or raise error once --retries is used up.
+
+        Exponential backoff with jitter, so parallel workers don't hit the CDN in lockstep."""
+        if failures > self.config.retries:
+            raise error
+        delay = min(RETRY_MAX_DELAY, self.config.retryBackoff * 2 ** (failures - 1))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        retry_after = getattr(getattr(error, 'response', None), 'headers', {}).get('retry-after', '')
+        if retry_after.isdigit():
+            delay = max(delay, min(RETRY_MAX_DELAY, int(retry_after)))
+        print('{} failed ({}), retry {}/{} in {:.1f}s'.format(what, error, failures, self.config.retries, delay))
+        self.metrics.add('retries')
+        time.sleep(delay)
+
+    def request(self, method, url, **kwargs):
+        """session.request with timeouts, retrying connection errors and 5xx answers."""
+        kwargs.setdefault('timeout', (self.config.connectTimeout, self.config.readTimeout))
+        failures = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                if failures >= self.config.retries:
+                    return response
+                error = requests.exceptions.HTTPError('{} {}'.format(response.status_code, response.reason),
+                                                      response=response)
+                response.close()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            failures += 1
+            self.backoff(failures, '{} {}'.format(method.upper(), url), error)
+
+    def get_text(self, url, headers=None):
+        """Retrieve a from a url as a string."""
+        req = self.request('get', url, headers=headers or self.headers)
+        req.encoding = 'utf-8'
+        return req.text
+
+    def mirror_url(self, url):
+        """Route url through the --mirror server, if one is configured."""
+        mirror = self.config.mirror
+        if not mirror:
+            return url
+        parts = urlsplit(url)
+        return '{}/{}/{}{}'.format(mirror.rstrip('/'), parts.scheme, parts.netloc,
+                                   url[len(parts.scheme) + 3 + len(parts.netloc):])
+
+    def unmirror_url(self, url):
+        """Reverse mirror_url."""
+        mirror = self.config.mirror
+        if not mirror or not url.startswith(mirror.rstrip('/') + '/'):
+            return url
+        scheme, rest = url[len(mirror.rstrip('/')) + 1:].split('/', 1)
+        return scheme + '://' + rest
+
+    def get_cached(self, url, cache_name, ttl):
+        """Retrieve url through the disk cache as bytes.
+
+        A copy younger than ttl seconds is used as is, an older one is revalidated
+        with If-None-Match/If-Modified-Since. In offline mode only the cache is used."""
+        body_path = os.path.join(self.config.cacheDir, cache_name)
+        meta_path = body_path + '.meta.json'
+        meta = None
+        if os.path.isfile(body_path) and os.path.isfile(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+
+        def cached_body():
+            with open(body_path, 'rb') as f:
+                return f.read()
+
+        if self.config.offline:
+            if meta is None:
+                raise CacheMiss('{} is not cached, run once without --offline'.format(cache_name))
+            return cached_body()
+        if meta and time.time() - meta['fetched'] < ttl:
+            return cached_body()
+
+        headers = self.headers.copy()
+        if meta and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta and meta.get('lastModified'):
+            headers['If-Modified-Since'] = meta['lastModified']
+        try:
+            req = self.request('get', url, headers=headers)
+            self.metrics.add_ttfb(req)
+            if meta and req.status_code == 304:
+                body = cached_body()
+            else:
+                req.raise_for_status()
+                body = req.content
+                meta = {'url': url, 'etag': req.headers.get('etag'), 'lastModified': req.headers.get('last-modified')}
+                os.makedirs(self.config.cacheDir, exist_ok=True)
+                write_file_atomic(body_path, body)
+        except requests.exceptions.RequestException as e:
+            if meta is None:
+                raise
+            print('Could not revalidate {} ({}), using the cached copy'.format(cache_name, e))
+            return cached_body()
+        meta['fetched'] = time.time()
+        write_file_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+        return body
+
+    def get_products_xml(self, adobeurl):
+        """First stage of parsing the XML."""
+        print('Source URL is: ' + adobeurl)
+        return ET.fromstring(self.get_text(adobeurl))
+
+
+class Catalog:
+    """The products.xml feeds and application.json manifests of a Packager.
+
+    Feeds are parsed once per URL version and platforms and kept in memory
+    until refresh(), every build shares them and must not modify them."""
+
+    def __init__(self, config, transport, metrics):
+        self.config = config
+        self.transport = transport
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.loading = {}
+        self.feeds = {}
+        self.catalogs = {}
+
+    def loading_lock(self, key):
+        """Lock held while a feed or catalog is loaded, so concurrent builds load it once."""
+        with self.lock:
+            return self.loading.setdefault(key, threading.Lock())
+
+    @timed('products_xml_fetch')
+    def get_products_feed(self, selectedVersion, ttl=None):
+        """Retrieve the raw products.xml of a URL version through the cache, ttl defaults to --cacheTTL."""
+        productsPlatform = 'osx10-64,osx10,macarm64,macuniversal'
+        adobeurl = self.transport.mirror_url(
+            ADOBE_PRODUCTS_XML_URL.format(urlVersion=selectedVersion, installPlatform=productsPlatform))
+
+        print('\nDownloading products.xml\n')
+        cache_name = 'products-v{}-{}.xml'.format(selectedVersion, productsPlatform.replace(',', '_'))
+        print('Source URL is: ' + adobeurl)
+        products_xml = self.transport.get_cached(adobeurl, cache_name, self.config.cacheTTL if ttl is None else ttl)
+        self.metrics.add('productsXmlBytes', len(products_xml))
+        return products_xml
+
+    def fetch_products_feeds(self, selectedVersion, ttl=None):
+        """Fetch the products.xml of a URL version, or of all of them concurrently for 'all'.
+
+        Returns {urlVersion: raw feed}."""
+        urlVersions = URL_VERSIONS if selectedVersion == 'all' else (selectedVersion,)
+        with ThreadPoolExecutor(max_workers=len(urlVersions)) as executor:
+            return dict(zip(urlVersions, executor.map(lambda v: self.get_products_feed(v, ttl), urlVersions)))
+
+    @timed('parse_products_xml')
+    def parse_feeds(self, feeds, allowedPlatforms):
+        """Parse the feeds of fetch_products_feeds into (products, cdn).
+
+        Several feeds are parsed in parallel worker processes and merged."""
+        if len(feeds) == 1:
+            (urlVersion, products_xml), = feeds.items()
+            products, cdn = parse_products_xml(products_xml, urlVersion, allowedPlatforms)
+            return products, self.transport.mirror_url(cdn)
+        with ProcessPoolExecutor(max_workers=len(feeds)) as executor:
+            futures = {urlVersion: executor.submit(parse_products_xml, products_xml, urlVersion, allowedPlatforms)
+                       for urlVersion, products_xml in feeds.items()}
+            results = {urlVersion: future.result() for urlVersion, future in futures.items()}
+        catalogs = [(urlVersion, products, self.transport.mirror_url(cdn) if cdn else cdn)
+                    for urlVersion, (products, cdn) in results.items()]
+        for urlVersion, products, _ in catalogs:
+            print('v{}: {} products'.format(urlVersion, len(products)))
+        products = merge_catalogs(catalogs, allowedPlatforms)
+        return products, max(catalogs, key=lambda c: c[0])[2]
+
+    def get_feeds(self, selectedVersion):
+        """The raw feeds of a URL version, fetched on first use."""
+        with self.loading_lock(selectedVersion):
+            feeds = self.feeds.get(selectedVersion)
+            if feeds is None:
+                feeds = self.fetch_products_feeds(selectedVersion)
+                with self.lock:
+                    self.feeds[selectedVersion] = feeds
+        return feeds
+
+    def get(self, selectedVersion, allowedPlatforms):
+        """Return (products, cdn) of a URL version ('all' merges them) for allowedPlatforms.
+
+        Raises CacheMiss when an offline run has no cached feed."""
+        key = (selectedVersion, tuple(allowedPlatforms))
+        with self.loading_lock(key):
+            catalog = self.catalogs.get(key)
+            if catalog is None:
+                feeds = self.get_feeds(selectedVersion)
+                print('\nParsing products.xml\n')
+                catalog = self.parse_feeds(feeds, allowedPlatforms)
+                with self.lock:
+                    self.catalogs[key] = catalog
+        return catalog
+
+    def refresh(self):
+        """Revalidate every feed in use and reparse the catalogs of the feeds that changed.
+
+        Builds holding a previous catalog finish with it. Returns the number of
+        catalogs replaced."""
+        with self.lock:
+            previous = dict(self.feeds)
+            keys = list(self.catalogs)
+        changed = set()
+        for selectedVersion, old_feeds in previous.items():
+            feeds = self.fetch_products_feeds(selectedVersion, ttl=0)
+            if feeds != old_feeds:
+                changed.add(selectedVersion)
+                with self.lock:
+                    self.feeds[selectedVersion] = feeds
+        replaced = 0
+        for selectedVersion, allowedPlatforms in keys:
+            if selectedVersion not in changed:
+                continue
+            catalog = self.parse_feeds(self.feeds[selectedVersion], list(allowedPlatforms))
+            with self.lock:
+                self.catalogs[(selectedVersion, allowedPlatforms)] = catalog
+            replaced += 1
+        return replaced
+
+    @timed('get_application_json')
+    def get_application_json(self, buildGuid):
+        """Retrieve JSON, from the buildGuid keyed cache when possible.
+
+        The manifest of a build never changes, so cached copies are never revalidated."""
+        cache_path = None
+        if re.fullmatch(r'[\w.-]+', buildGuid):
+            cache_path = os.path.join(self.config.cacheDir, APPLICATION_JSON_CACHE_DIR, buildGuid + '.json')
+        if cache_path and os.path.isfile(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    app_json = json.loads(f.read())
+                os.utime(cache_path)  # Keep recently used manifests on eviction
+                self.metrics.add('applicationJsonCacheHits')
+                return app_json
+            except (OSError, ValueError):
+                pass  # Evicted or damaged, fetch it again
+        if self.config.offline:
+            raise CacheMiss('application.json of build {} is not cached, run once without --offline'.format(buildGuid))
+        headers = self.transport.headers.copy()
+        headers['x-adobe-build-guid'] = buildGuid
+        req = self.transport.request('get', self.transport.mirror_url(ADOBE_APPLICATION_JSON_URL), headers=headers)
+        self.metrics.add_ttfb(req)
+        req.raise_for_status()
+        self.metrics.add('applicationJsonFetches')
+        self.metrics.add('applicationJsonBytes', len(req.content))
+        app_json = json.loads(req.content)
+        if cache_path:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            write_file_atomic(cache_path, req.content)
+        return app_json
+
+    def prune_application_json_cache(self, max_bytes):
+        """Evict the least recently used cached manifests until the cache fits in max_bytes."""
+        cache_dir = os.path.join(self.config.cacheDir, APPLICATION_JSON_CACHE_DIR)
+        if not os.path.isdir(cache_dir):
+            return
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.is_file() and entry.name.endswith('.json'):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    @timed('prefetch_application_json')
+    def prefetch_application_json(self, buildGuids):
+        """Retrieve the manifests of several builds concurrently, returns {buildGuid: app_json}."""
+        buildGuids = list(OrderedDict.fromkeys(buildGuids))
+        with ThreadPoolExecutor(max_workers=self.config.jobs) as executor:
+            app_jsons = dict(zip(buildGuids, executor.map(self.get_application_json, buildGuids)))
+        self.prune_application_json_cache(self.config.appJsonCacheSize * 1024 * 1024)
+        return app_jsons
+
+    def product_languages(self, prodInfo):
+        """Install languages of a build from its application.json, plus ALL."""
+        try:
+            app_json = self.get_application_json(prodInfo['buildGuid'])
+            langs = [lang['locale'] for lang in app_json['SupportedLanguages']['Language']]
+        except (requests.exceptions.RequestException, CacheMiss, KeyError, TypeError, ValueError):
+            return INSTALL_LANGUAGES
+        return langs + ['ALL'] if langs else INSTALL_LANGUAGES
+
+    def get_APRO_download_url(self, appInfo, cdn):
+        manifest = self.transport.get_products_xml(cdn + appInfo['buildGuid'])
+        return self.transport.mirror_url(manifest.find('asset_list/asset/asset_path').text)
+
+
+class Resolver:
+    """Plans installers from the catalog: products, dependencies and packages to download."""
+
+    def __init__(self, config, catalog, metrics):
+        self.config = config
+        self.catalog = catalog
+        self.metrics = metrics
+
+    def expand_job(self, job, defaults=None):
+        """Split a job whose arch is 'all' into one job per architecture, other jobs stay as they are."""
+        arch = job.get('arch') or (defaults or {}).get('arch') or self.config.arch
+        if arch and str(arch).lower() == 'all':
+            return [dict(job, arch='x64'), dict(job, arch='arm64')]
+        return [job]
+
+    def plan_job(self, job, selectedVersion, defaults=None, dest=None):
+        """Plan the installer of a batch job ({'sapCode', 'version', 'installLanguage', 'arch', ...}).
+
+        Settings missing from the job come from defaults, then from the
+        configuration, dest replaces the destination when given. Returns a
+        plan_installer build, for Acrobat {'apro': True, 'prodInfo', 'cdn', 'dest'}.
+        Raises JobError when the job can't be built."""
+        defaults = defaults or {}
+
+        def option(name):
+            return job.get(name) or defaults.get(name) or getattr(self.config, name)
+
+        sapCode = job.get('sapCode', '').upper()
+        arch = option('arch') or platform.machine()
+        ism1 = parse_arch(arch)
+        if ism1 is None:
+            raise JobError('[{}] Invalid architecture "{}"'.format(sapCode, arch))
+        products, cdn = self.catalog.get(selectedVersion, get_allowed_platforms(ism1))
+
+        product = products.get(sapCode)
+        if not product:
+            raise JobError('[{}] SAP Code not found in products'.format(sapCode))
+        version = job.get('version') or product['latestVersion']
+        prodInfo = product['versions'].get(version)
+        if not prodInfo:
+            raise JobError('[{}_{}] Version not found'.format(sapCode, version))
+        cdn = prodInfo.get('cdn', cdn)
+        dest = dest or option('destination')
+        if not dest:
+            raise JobError('[{}_{}] No destination in the manifest or on the command line'.format(sapCode, version))
+
+        if sapCode == 'APRO':
+            return {'apro': True, 'prodInfo': prodInfo, 'cdn': cdn, 'dest': dest}
+
+        installLanguage = format_language(option('installLanguage') or 'en_US')
+        oslang = format_language(option('osLanguage') or installLanguage)
+        if installLanguage not in self.catalog.product_languages(prodInfo):
+            raise JobError('[{}_{}] Language not available: {}'.format(sapCode, version, installLanguage))
+
+        previous = job.get('from')
+        if previous and not os.path.isdir(os.path.join(previous, 'Contents', 'Resources', 'products')):
+            raise JobError('[{}_{}] Not an installer created by this script: {}'.format(sapCode, version, previous))
+        return plan_installer(products, cdn, prodInfo, installLanguage, oslang, dest, previous)
+
+    def select_packages(self, build, app_json):
+        """select_packages for the languages and architecture of build."""
+        return select_packages(app_json, build['installLanguage'], build['oslang'], build['arch'],
+                               self.config.osVersion)
+
+    def prepare_installer(self, build, app_jsons):
+        """Save the application.json files of an installer and return its download tasks."""
+        products_dir = build['products_dir']
+        for p in build['prods_to_download']:
+            s, v = p['sapCode'], p['version']
+            product_dir = os.path.join(products_dir, s)
+            app_json_path = os.path.join(product_dir, 'application.json')
+
+            app_json = app_jsons[p['buildGuid']]
+            p['application_json'] = app_json
+
+            print('[{}_{}] Creating folder for product'.format(s, v))
+            os.makedirs(product_dir, exist_ok=True)
+
+            print('[{}_{}] Saving application.json'.format(s, v))
+            with open(app_json_path, 'w') as file:
+                json.dump(app_json, file, separators=(',', ':'))
+
+            print('')
+
+        journal = BuildJournal(products_dir)
+        tasks = []
+        for p in build['prods_to_download']:
+            s, v = p['sapCode'], p['version']
+            product_dir = os.path.join(products_dir, s)
+
+            print('[{}_{}] Parsing available packages'.format(s, v))
+            core, noncore = self.select_packages(build, p['application_json'])
+            print('[{}_{}] Selected {} core packages and {} non-core packages'.format(s,
+                  v, len(core), len(noncore)))
+            skipped = [pkg for pkg in p['application_json']['Packages']['Package'] if pkg not in core and pkg not in noncore]
+            if skipped:
+                skipped_bytes = sum(pkg.get('DownloadSize') or 0 for pkg in skipped)
+                self.metrics.add('conditionSkippedBytes', skipped_bytes)
+                print('[{}_{}] Skipped {} packages ({}) whose conditions exclude this installer'.format(
+                    s, v, len(skipped), format_size(skipped_bytes)))
+
+            tasks.extend({'url': build['cdn'] + pkg['Path'], 'product_dir': product_dir, 'sapCode': s, 'version': v,
+                          'size': pkg.get('DownloadSize'), 'core': pkg in core, 'package': pkg, 'journal': journal}
+                         for pkg in core + noncore)
+        build['tasks'] = tasks
+        return tasks
+
+    def reuse_previous_build(self, build):
+        """Link the packages that didn't change since build['from'] into the new installer.
+
+        Returns the tasks that still have to be downloaded."""
+        if not build.get('from'):
+            return build['tasks']
+        previous = previous_packages(build['from'])
+        remaining = []
+        saved = 0
+        for t in build['tasks']:
+            src = previous_package(previous, t['package'])
+            if not src:
+                remaining.append(t)
+                continue
+            link_file(src, task_path(t))
+            t['journal'].add(task_path(t), t['size'])
+            saved += t['size']
+        self.metrics.add('previousBuildBytes', saved)
+        print('Reused {} unchanged packages ({}) from {}, {} packages to download\n'.format(
+            len(build['tasks']) - len(remaining), format_size(saved), build['from'], len(remaining)))
+        return remaining
+
+
+class Downloader:
+    """Downloads packages into installers and the package store of a Packager."""
+
+    def __init__(self, config, transport, metrics):
+        self.config = config
+        self.transport = transport
+        self.metrics = metrics
+        self.store_locks = {}
+        self.store_locks_lock = threading.Lock()
+
+    def pipeline(self, fd, offset):
+        return WritePipeline(fd, offset, self.config.bufferSize, self.transport.rate_limiter, self.metrics)
+
+    def download_stream(self, url, part_path, progress, offset=0):
+        """Download url into part_path over a single GET stream, continuing at offset."""
+        headers = self.transport.headers.copy()
+        if offset:
+            headers['Range'] = 'bytes={}-'.format(offset)
+        response = self.transport.request('get', url, stream=True, headers=headers)
+        self.metrics.add_ttfb(response)
+        response.raise_for_status()
+        if response.status_code != 206:
+            offset = 0
+        total_size_in_bytes = int(
+            response.headers.get('content-length', 0))
+        if total_size_in_bytes:
+            total_size_in_bytes += offset
+        progress.reset(total_size_in_bytes, offset)
+        fd = os.open(part_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, offset)
+            preallocate(fd, total_size_in_bytes)
+            pipeline = self.pipeline(fd, offset)
+            pipeline.copy(response, progress=progress)
+        finally:
+            os.close(fd)
+        if total_size_in_bytes != 0 and pipeline.offset != total_size_in_bytes:
+            raise IncompleteDownload('got {} of {} bytes'.format(pipeline.offset, total_size_in_bytes))
+
+    def download_range(self, url, fd, start, end, progress):
+        """Download bytes start-end (inclusive) of url and pwrite them into fd.
+
+        A connection lost mid-segment is continued from the last byte written."""
+        pipeline = self.pipeline(fd, start)
+        failures = 0
+        while True:
+            headers = self.transport.headers.copy()
+            headers['Range'] = 'bytes={}-{}'.format(pipeline.offset, end)
+            reached = pipeline.offset
+            try:
+                response = self.transport.request('get', url, stream=True, headers=headers)
+                self.metrics.add_ttfb(response)
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise RangeNotSupported('server answered {} to a range request'.format(response.status_code))
+                pipeline.copy(response, end, progress)
+                if pipeline.offset != end + 1:
+                    raise IncompleteDownload('segment {}-{} ended at {}'.format(start, end, pipeline.offset))
+                return
+            except TRANSIENT_ERRORS as e:
+                failures = 1 if pipeline.offset > reached else failures + 1
+                self.transport.backoff(failures, 'Segment {}-{} at byte {}'.format(start, end, pipeline.offset), e)
+                self.metrics.add('rangeContinuations')
+
+    def download_segmented(self, url, file_path, total_size_in_bytes, segments, progress):
+        """Download url as parallel byte ranges into a preallocated file."""
+        segment_size = -(-total_size_in_bytes // segments)
+        ranges = [(start, min(start + segment_size, total_size_in_bytes) - 1)
+                  for start in range(0, total_size_in_bytes, segment_size)]
+        with open(file_path, 'wb') as file:
+            file.truncate(total_size_in_bytes)
+        fd = os.open(file_path, os.O_WRONLY)
+        try:
+            preallocate(fd, total_size_in_bytes)
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                futures = [executor.submit(self.download_range, url, fd, start, end, progress)
+                           for start, end in ranges]
+                for future in futures:
+                    future.result()
+        finally:
+            os.close(fd)
+
+    def fetch_file(self, url, file_path, total_size_in_bytes, accept_ranges, s, v, name, progress=None):
+        """Download url to file_path through a .part file, resuming or segmenting when possible.
+
+        Bytes are counted in progress, else in a Progress of this file alone."""
+        part_path = file_path + PART_SUFFIX
+        offset = 0
+        if self.config.skipExisting and os.path.isfile(part_path):
+            offset = os.path.getsize(part_path)
+            if total_size_in_bytes and offset > total_size_in_bytes:
+                offset = 0
+        segmented = (self.config.segments > 1 and not offset and total_size_in_bytes >= SEGMENT_MIN_SIZE
+                     and accept_ranges)
+        own_progress = progress is None
+        if own_progress:
+            progress = Progress(self.config.progress, 1, total_size_in_bytes).start()
+        progress_file = progress.open(s, v, name, total_size_in_bytes)
+        status = 'failed'
+        try:
+            if segmented:
+                # Segments leave holes behind, so an interrupted segmented file can't be resumed
+                segmented_path = file_path + SEGMENTED_PART_SUFFIX
+                try:
+                    self.download_segmented(url, segmented_path, total_size_in_bytes, self.config.segments,
+                                            progress_file)
+                    os.replace(segmented_path, file_path)
+                except RangeNotSupported:
+                    progress.write('[{}_{}] Range requests not honoured for {}, using a single stream'.format(s, v, name))
+                    self.metrics.add('rangeFallbacks')
+                    segmented = False
+                finally:
+                    # Nothing can be resumed from it, don't leave it in the installer
+                    if os.path.isfile(segmented_path):
+                        os.remove(segmented_path)
+            if not segmented:
+                if offset:
+                    progress.write('[{}_{}] Resuming {} at {} bytes'.format(s, v, name, offset))
+                    self.metrics.add('resumedDownloads')
+                failures = 0
+                done = total_size_in_bytes and offset >= total_size_in_bytes
+                while not done:
+                    try:
+                        self.download_stream(url, part_path, progress_file, offset)
+                        done = True
+                    except TRANSIENT_ERRORS as e:
+                        # Continue with a Range request from what made it to disk
+                        reached = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+                        # Only a download that continues where this one stopped made progress
+                        failures = 1 if accept_ranges and reached > offset else failures + 1
+                        offset = reached if accept_ranges else 0
+                        self.transport.backoff(failures, '[{}_{}] {} at byte {}'.format(s, v, name, offset), e)
+                        if offset:
+                            self.metrics.add('rangeContinuations')
+                os.replace(part_path, file_path)
+            status = 'done'
+        finally:
+            progress.close(progress_file)
+            if own_progress:
+                progress.finish(s, v, name, progress_file.size, status)
+                progress.end()
+
+    def package_store_path(self, url, size):
+        """Location of a package in the shared store, keyed by its CDN path and size."""
+        path = urlsplit(self.transport.unmirror_url(url)).path
+        digest = hashlib.sha256(path.encode('utf-8')).hexdigest()
+        name = path.split('/')[-1]
+        return os.path.join(self.config.store, digest[:2], '{}-{}-{}'.format(digest[:32], size, name))
+
+    @contextmanager
+    def package_store_lock(self, store_path):
+        """Serialise downloads of one store entry, between threads and between processes sharing the store."""
+        with self.store_locks_lock:
+            lock = self.store_locks.setdefault(store_path, threading.Lock())
+        with lock, open(store_path + STORE_LOCK_SUFFIX, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def prune_package_store(self, max_bytes):
+        """Remove the least recently used packages until the store fits in max_bytes.
+
+        Installers keep their hardlinks, only the store's reference goes away."""
+        entries = []
+        for root, _, files in os.walk(self.config.store):
+            for f in files:
+                if f.endswith(PART_SUFFIX) or f.endswith(STORE_LOCK_SUFFIX):
+                    continue
+                path = os.path.join(root, f)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    @timed('download_file')
+    def download_file(self, url, product_dir, s, v, name=None, journal=None, size=None, progress=None):
+        """Download a file, returns False when it was already there or linked from the store.
+
+        progress is the Progress of the downloads this one is part of."""
+        if not name:
+            name = url.split('/')[-1].split('?')[0]
+        say = progress.write if progress else print
+        file_path = os.path.join(product_dir, name)
+        if self.config.skipExisting and journal and journal.is_done(file_path):
+            say('[{}_{}] {} already downloaded, skipping'.format(s, v, name))
+            self.metrics.add('skippedFiles')
+            return False
+        if self.config.store and size:
+            store_path = self.package_store_path(url, size)
+            if os.path.isfile(store_path) and os.path.getsize(store_path) == size:
+                link_file(store_path, file_path)
+                if journal:
+                    journal.add(file_path, size)
+                say('[{}_{}] Linked {} from the package store'.format(s, v, name))
+                self.metrics.add('storeLinkedFiles')
+                return False
+        say('Url is: ' + url)
+        say('[{}_{}] Downloading {}'.format(s, v, name))
+        response = self.transport.request('head', url, stream=True, headers=ADOBE_DL_HEADERS)
+        self.metrics.add_ttfb(response)
+        total_size_in_bytes = int(
+            response.headers.get('content-length', 0))
+        if (self.config.skipExisting and os.path.isfile(file_path) and os.path.getsize(file_path) == total_size_in_bytes):
+            say('[{}_{}] {} already exists, skipping'.format(s, v, name))
+            self.metrics.add('skippedFiles')
+            if journal:
+                journal.add(file_path, total_size_in_bytes)
+            return False
+        accept_ranges = response.headers.get('accept-ranges', '').lower() == 'bytes'
+        if self.config.store and total_size_in_bytes:
+            store_path = self.package_store_path(url, total_size_in_bytes)
+            os.makedirs(os.path.dirname(store_path), exist_ok=True)
+            with self.package_store_lock(store_path):
+                if not (os.path.isfile(store_path) and os.path.getsize(store_path) == total_size_in_bytes):
+                    self.fetch_file(url, store_path, total_size_in_bytes, accept_ranges, s, v, name, progress)
+            link_file(store_path, file_path)
+        else:
+            self.fetch_file(url, file_path, total_size_in_bytes, accept_ranges, s, v, name, progress)
+        if journal:
+            journal.add(file_path, os.path.getsize(file_path))
+        self.metrics.add('downloadedFiles')
+        say('[{}_{}] Downloaded {}'.format(s, v, name))
+        return True
+
+    def order_tasks(self, tasks):
+        """Order the download queue according to --order.
+
+        Starting with the largest files keeps one big package from finishing
+        alone at the end of a parallel download."""
+        if self.config.order == 'largest-first':
+            return sorted(tasks, key=lambda t: -(t.get('size') or 0))
+        if self.config.order == 'smallest-first':
+            return sorted(tasks, key=lambda t: t.get('size') or 0)
+        if self.config.order == 'core-first':
+            return sorted(tasks, key=lambda t: not t.get('core'))
+        return list(tasks)
+
+    @timed('download_packages')
+    def download_packages(self, tasks, archive=None):
+        """Download tasks ({'url', 'product_dir', 'sapCode', 'version', 'size', 'core', 'journal'}) on a bounded worker pool.
+
+        Finished files are added to archive, if given. Returns the list of
+        urls that failed, a failed file does not stop the others."""
+        failed = []
+        tasks = self.order_tasks(tasks)
+        sizes_known = all(t.get('size') for t in tasks)
+        total = sum(t.get('size') or 0 for t in tasks)
+        rate = self.transport.rate_limiter.current_rate()
+        if sizes_known and rate:
+            print('Limited to {}/s, {} expected to finish at {}\n'.format(
+                format_size(rate), format_size(total), format_eta(total / rate)))
+        progress = Progress(self.config.progress, len(tasks), total if sizes_known else 0).start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.config.jobs) as executor:
+                futures = {executor.submit(self.download_file, t['url'], t['product_dir'], t['sapCode'], t['version'],
+                                           journal=t.get('journal'), size=t.get('size'), progress=progress): t
+                           for t in tasks}
+                for future in as_completed(futures):
+                    t = futures[future]
+                    try:
+                        downloaded = future.result()
+                        if archive:
+                            archive.add(task_path(t))
+                        progress.finish(t['sapCode'], t['version'], os.path.basename(task_path(t)), t.get('size'),
+                                        'done' if downloaded else 'skipped')
+                    except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError, DownloadError,
+                            OSError) as e:
+                        progress.write('[{}_{}] ERROR downloading {}: {}'.format(t['sapCode'], t['version'], t['url'], e))
+                        self.metrics.add('failedFiles')
+                        failed.append(t['url'])
+                        progress.finish(t['sapCode'], t['version'], os.path.basename(task_path(t)), t.get('size'),
+                                        'failed', str(e))
+        finally:
+            progress.end()
+        if self.config.store and self.config.storeMaxSize:
+            self.prune_package_store(self.config.storeMaxSize * 1024 ** 3)
+        return failed
+
+    def get_download_sizes(self, urls):
+        """HEAD several urls concurrently, returns {url: content-length or None}."""
+        def head(url):
+            try:
+                response = self.transport.request('head', url, headers=ADOBE_DL_HEADERS, allow_redirects=True)
+                response.raise_for_status()
+                return int(response.headers['content-length'])
+            except (requests.exceptions.RequestException, KeyError, ValueError):
+                return None
+        urls = list(OrderedDict.fromkeys(urls))
+        with ThreadPoolExecutor(max_workers=self.config.jobs) as executor:
+            return dict(zip(urls, executor.map(head, urls)))
+
+
+class Packager:
+    """Builds installers, the entry point for embedding the packager in another program.
+
+    config is a namespace as returned by parse_args, options override single
+    settings of it, e.g. Packager(jobs=8, cacheDir='/var/cache/ccdl'). The
+    catalog, the connection pool and the package store are shared by every
+    call, so one Packager can build several installers on different threads
+    at once:
+
+        packager = Packager(destination='/Volumes/Installers')
+        packager.run_batch({'jobs': [{'sapCode': 'PHSP', 'arch': 'arm64'}]})
+
+    Nothing prompts or exits, the interactive parts are in the command line
+    functions below."""
+
+    def __init__(self, config=None, **options):
+        config = argparse.Namespace(**vars(config if config is not None else parse_args([])))
+        for name, value in options.items():
+            if not hasattr(config, name):
+                raise TypeError('Unknown option: ' + name)
+            setattr(config, name, value)
+        self.config = config
+        self.metrics = Metrics()
+        self.transport = Transport(config, self.metrics)
+        self.catalog = Catalog(config, self.transport, self.metrics)
+        self.resolver = Resolver(config, self.catalog, self.metrics)
+        self.downloader = Downloader(config, self.transport, self.metrics)
+
+    @timed('build_installers')
+    def build_installers(self, builds, archive=None):
+        """Create installers, fetching every application.json and package only once.
+
+        Packages shared by several installers are downloaded for the first one and
+        linked into the others. Files are added to archive as they are finished,
+        if given. Returns the number of incomplete installers, they are marked
+        with 'incomplete'."""
+        buildGuids = [p['buildGuid'] for build in builds for p in build['prods_to_download']]
+        print('\nDownloading {} application.json files'.format(len(set(buildGuids))))
+        try:
+            app_jsons = self.catalog.prefetch_application_json(buildGuids)
+        except CacheMiss as e:
+            print(e)
+            for build in builds:
+                build['incomplete'] = True
+            return len(builds)
+
+        tasks = []
+        for build in builds:
+            print('\nCreating {}'.format(build['install_app_name']))
+            create_installer_app(build['install_app_path'])
+
+            print('\nPreparing...\n')
+            self.resolver.prepare_installer(build, app_jsons)
+            tasks.extend(self.resolver.reuse_previous_build(build))
+            if archive:
+                archive.add_tree(build['install_app_path'])
+
+        print('Downloading...\n')
+
+        unique = OrderedDict()
+        shared = []
+        for t in tasks:
+            if t['url'] in unique:
+                t['source'] = unique[t['url']]
+                shared.append(t)
+                continue
+            unique[t['url']] = t
+        print('\nDownloading {} packages with {} parallel jobs\n'.format(len(unique), self.config.jobs))
+        if shared:
+            print('{} more packages are shared between installers and will be linked\n'.format(len(shared)))
+        failed = set(self.downloader.download_packages(list(unique.values()), archive))
+        for t in shared:
+            if t['source']['url'] in failed or (self.config.skipExisting and t['journal'].is_done(task_path(t))):
+                continue
+            link_file(task_path(t['source']), task_path(t))
+            t['journal'].add(task_path(t), os.path.getsize(task_path(t)))
+            if archive:
+                archive.add(task_path(t))
+
+        incomplete = 0
+        for build in builds:
+            print('\nGenerating driver.xml')
+            write_driver_xml(build)
+            if archive:
+                archive.add_tree(build['install_app_path'])
+
+            build_failed = [t for t in build['tasks'] if t.get('source', t)['url'] in failed]
+            if build_failed:
+                build['incomplete'] = True
+                incomplete += 1
+                print('\n{} of {} packages failed to download, {} is incomplete.'.format(
+                    len(build_failed), len(build['tasks']), build['install_app_path']))
+                if archive:
+                    print('The archive will not be written, run the build again.')
+                else:
+                    print('Run again with --skipExisting to retry the missing packages.')
+                continue
+            if ((self.config.verify or self.config.verifyFull) and self.verify_installer(
+                    build['install_app_path'], [(task_path(t), t['size']) for t in build['tasks']], remove=True,
+                    store_paths={task_path(t): self.downloader.package_store_path(t['url'], os.path.getsize(task_path(t)))
+                                 for t in build['tasks'] if self.config.store and os.path.isfile(task_path(t))})):
+                build['incomplete'] = True
+                incomplete += 1
+                if archive:
+                    print('\n{} is incomplete, the archive will not be written, run the build again.'.format(
+                        build['install_app_path']))
+                else:
+                    print('\n{} is incomplete, run again with --skipExisting to download the broken packages again.'.format(
+                        build['install_app_path']))
+                continue
+
+            if archive:
+                print('\nPackage successfully created in {} as {}.'.format(
+                    archive.path, os.path.relpath(build['install_app_path'], archive.root)))
+                continue
+            print('\nPackage successfully created. Run {} to install.'.format(build['install_app_path']))
+        return incomplete
+
+    @timed('verify')
+    def verify_packages(self, packages):
+        """Check package zips given as (path, DownloadSize), returns {path: error} of the broken ones.
+
+        Quick checks run on --jobs threads, --verifyFull decompresses on every CPU.
+        Files linked into several installers are checked once."""
+        full = self.config.verifyFull
+        by_inode = OrderedDict()
+        for path, size in packages:
+            st = os.stat(path)
+            by_inode.setdefault((st.st_dev, st.st_ino), (path, size, []))[2].append(path)
+        checks = list(by_inode.values())
+        if full:
+            executor = ProcessPoolExecutor()
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.config.jobs)
+        with executor:
+            results = executor.map(verify_package, [c[0] for c in checks], [c[1] for c in checks],
+                                   [full] * len(checks))
+            errors = {}
+            for (_, _, paths), error in zip(checks, results):
+                if error:
+                    errors.update((path, error) for path in paths)
+        self.metrics.add('verifiedPackages', len(checks))
+        self.metrics.add('brokenPackages', len(errors))
+        return errors
+
+    def verify_installer(self, app_path, packages=None, remove=False, store_paths=None):
+        """Check the packages of an installer, by default every zip listed in its application.json files.
+
+        Broken packages are reported and, with remove, deleted so that a run
+        with --skipExisting downloads them again. Their entries in the package
+        store, given as store_paths {path: store path}, are deleted too, or
+        the next run would link the same broken file. Returns how many are broken."""
+        partial = []
+        missing = []
+        if packages is None:
+            packages, partial, missing = installer_packages(app_path, self.config.osVersion)
+        print('\nVerifying {} packages of {}{}'.format(len(packages) + len(missing), app_path,
+                                                      ' with CRC-32' if self.config.verifyFull else ''))
+        errors = self.verify_packages(packages)
+        for path in partial:
+            errors[path] = 'incomplete download'
+        for path in missing:
+            errors[path] = 'missing'
+        for path, error in errors.items():
+            print('BROKEN {}: {}'.format(os.path.relpath(path, app_path), error))
+            if remove and os.path.isfile(path):
+                os.remove(path)
+                store_path = (store_paths or {}).get(path)
+                if store_path and os.path.isfile(store_path):
+                    os.remove(store_path)
+                    self.metrics.add('storeEvictedFiles')
+        if errors:
+            print('{} of {} packages are broken'.format(len(errors), len(packages) + len(partial) + len(missing)))
+        else:
+            print('All {} packages are intact'.format(len(packages)))
+        return len(errors)
+
+    def report_plan(self, builds):
+        """Print packages and download sizes of installers without creating them.
+
+        Sizes come from DownloadSize in application.json or a HEAD request. Returns
+        False when a destination has not enough free space."""
+        buildGuids = [p['buildGuid'] for build in builds for p in build['prods_to_download']]
+        print('\nDownloading {} application.json files'.format(len(set(buildGuids))))
+        try:
+            app_jsons = self.catalog.prefetch_application_json(buildGuids)
+        except CacheMiss as e:
+            print(e)
+            return False
+
+        selections = []
+        for build in builds:
+            for p in build['prods_to_download']:
+                core, noncore = self.resolver.select_packages(build, app_jsons[p['buildGuid']])
+                selections.append((build, p, core, noncore))
+        sizes = {}
+        unknown = [build['cdn'] + pkg['Path'] for build, _, core, noncore in selections
+                   for pkg in core + noncore if not pkg.get('DownloadSize')]
+        if unknown:
+            print('Requesting the size of {} packages'.format(len(set(unknown))))
+            sizes = self.downloader.get_download_sizes(unknown)
+
+        unique = {}
+        needed = {}
+        for build in builds:
+            print('\n' + build['install_app_path'])
+            previous = previous_packages(build['from']) if build.get('from') else {}
+            build_bytes = 0
+            build_count = 0
+            reused_bytes = 0
+            reused_count = 0
+            for b, p, core, noncore in selections:
+                if b is not build:
+                    continue
+                product_bytes = 0
+                for pkg in core + noncore:
+                    url = build['cdn'] + pkg['Path']
+                    size = pkg.get('DownloadSize') or sizes.get(url) or 0
+                    product_bytes += size
+                    if previous and previous_package(previous, pkg):
+                        reused_bytes += size
+                        reused_count += 1
+                    elif url not in unique:
+                        unique[url] = size
+                        dest = os.path.dirname(build['install_app_path'])
+                        needed[dest] = needed.get(dest, 0) + size
+                print('[{}_{}] {} core and {} non-core packages, {}'.format(
+                    p['sapCode'], p['version'], len(core), len(noncore), format_size(product_bytes)))
+                build_bytes += product_bytes
+                build_count += len(core) + len(noncore)
+            print('Total: {} packages, {}'.format(build_count, format_size(build_bytes)))
+            if previous:
+                print('Unchanged since {}: {} packages, {} not downloaded'.format(
+                    build['from'], reused_count, format_size(reused_bytes)))
+
+        if len(builds) > 1:
+            print('\nAll installers: {} unique packages, {} to download'.format(len(unique), format_size(sum(unique.values()))))
+        if any(not size for size in unique.values()):
+            print('The size of {} packages is unknown'.format(sum(1 for size in unique.values() if not size)))
+
+        fits = True
+        for dest, size in needed.items():
+            existing = dest
+            while not os.path.isdir(existing):
+                existing = os.path.dirname(existing) or '.'
+            free = shutil.disk_usage(existing).free
+            if free < size:
+                fits = False
+            print('{}: {} needed, {} free{}'.format(dest, format_size(size), format_size(free),
+                                                   '' if free >= size else ', NOT ENOUGH SPACE'))
+        return fits
+
+    def download_APRO(self, appInfo, cdn, dest, archive=None):
+        """Download APRO"""
+        downloadURL = self.catalog.get_APRO_download_url(appInfo, cdn)
+        sapCode = appInfo['sapCode']
+        version = appInfo['productVersion']
+        name = 'Intall {}_{}_{}.dmg'.format(sapCode, version, appInfo['apPlatform'])
+        print('')
+        print('sapCode: ' + sapCode)
+        print('version: ' + version)
+        print('installLanguage: ' + 'ALL')
+        print('dest: ' + os.path.join(dest, name))
+
+        print('\nDownloading...\n')
+
+        print('[{}_{}] Selected 1 package'.format(sapCode, version))
+        try:
+            self.downloader.download_file(downloadURL, dest, sapCode, version, name)
+        except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError, DownloadError, OSError) as e:
+            print('[{}_{}] ERROR downloading {}: {}'.format(sapCode, version, name, e))
+            return False
+        if archive:
+            archive.add(os.path.join(dest, name))
+
+        print('\nInstaller successfully downloaded. Open ' + os.path.join(dest, name) + ' and run Acrobat/Acrobat DC Installer.pkg to install.')
+        return True
+
+    def plan_APRO(self, appInfo, cdn):
+        """Report the size of the Acrobat DMG without downloading it."""
+        downloadURL = self.catalog.get_APRO_download_url(appInfo, cdn)
+        size = self.downloader.get_download_sizes([downloadURL])[downloadURL]
+        print('[{}_{}] 1 package, {}'.format(appInfo['sapCode'], appInfo['productVersion'],
+                                             format_size(size) if size is not None else 'unknown size'))
+
+    @timed('run_batch')
+    def run_batch(self, manifest, archive=None):
+        """Build every installer of a batch manifest (see load_batch_manifest).
+
+        products.xml is fetched once and parsed once per architecture, installers
+        go into archive, if given. Returns the number of jobs that failed."""
+        if isinstance(manifest, list):
+            manifest = {'jobs': manifest}
+        urlVersion = self.config.urlVersion or str(manifest.get('urlVersion', 6))
+        selectedVersion = parse_url_version(urlVersion)
+        if not selectedVersion:
+            print('Invalid argument "{}" for {}'.format(urlVersion, 'URL version'))
+            return len(manifest['jobs']) or 1
+
+        builds = OrderedDict()
+        apro = []
+        errors = 0
+        # The installers of every planned job, as install_app_path or (buildGuid, dest) of Acrobat
+        job_installers = []
+        for job in manifest['jobs']:
+            planned = []
+            job_errors = []
+            for j in self.resolver.expand_job(job, manifest):
+                try:
+                    planned.append(self.resolver.plan_job(j, selectedVersion, manifest, archive.root if archive else None))
+                except JobError as e:
+                    job_errors.append(e)
+                except CacheMiss as e:
+                    print(e)
+                    return len(manifest['jobs'])
+            for e in OrderedDict.fromkeys(str(e) for e in job_errors):
+                # With arch all, a version built for one architecture only is not an error
+                print('{}{}'.format(e, ', skipping that architecture' if planned else ''))
+            if not planned:
+                errors += 1
+                continue
+            installers = set()
+            for build in planned:
+                if not build.get('apro'):
+                    # Both architectures of a macuniversal build are the same installer
+                    builds.setdefault(build['install_app_path'], build)
+                    installers.add(build['install_app_path'])
+                    continue
+                key = (build['prodInfo']['buildGuid'], build['dest'])
+                if not any((a['prodInfo']['buildGuid'], a['dest']) == key for a in apro):
+                    apro.append(build)
+                installers.add(key)
+            job_installers.append(installers)
+
+        print('\n{} installers to build'.format(len(builds) + len(apro)))
+        if self.config.plan:
+            for build in apro:
+                self.plan_APRO(build['prodInfo'], build['cdn'])
+            if builds and not self.report_plan(list(builds.values())):
+                errors += sum(1 for installers in job_installers if installers & set(builds))
+            return errors
+        incomplete = set()
+        for build in apro:
+            if not self.download_APRO(build['prodInfo'], build['cdn'], build['dest'], archive):
+                incomplete.add((build['prodInfo']['buildGuid'], build['dest']))
+        if builds:
+            self.build_installers(list(builds.values()), archive)
+            incomplete.update(path for path, build in builds.items() if build.get('incomplete'))
+        errors += sum(1 for installers in job_installers if installers & incomplete)
+        if errors:
+            print('\n{} of {} jobs failed'.format(errors, len(manifest['jobs'])))
+        return errors
+
+    def serve(self, address):
+        """Serve the caching mirror on [host:]port until interrupted."""
+        host, _, port = address.rpartition(':')
+        server = MirrorServer((host or '127.0.0.1', int(port)), self)
+        print('Serving the Adobe mirror on http://{}:{}, cache in {}'.format(
+            server.server_address[0], server.server_address[1], os.path.join(self.config.cacheDir, 'mirror')))
+        print('Point clients at it with --mirror http://<this host>:{}'.format(server.server_address[1]))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+
+
+MIRROR_FORWARD_HEADERS = ('X-Adobe-App-Id', 'User-Agent', 'X-Api-Key', 'Cookie', 'Authorization', 'x-adobe-build-guid')
+
+
+class MirrorFill:
+    """One upstream fetch into the mirror cache, shared by every client asking for it."""
+
+    def __init__(self, part_path):
+        self.part_path = part_path
+        self.started = threading.Event()
+        self.progress = threading.Condition()
+        self.done = False
+        self.written = 0
+        self.status = None
+        self.size = None
+        self.headers = {}
+        self.body = b''
+        self.error = None
+
+    def wait_for(self, offset):
+        """Block until the part file holds more than offset bytes or the fill ended."""
+        with self.progress:
+            while not self.done and self.written <= offset:
+                self.progress.wait(0.5)
+
+
+class MirrorServer(ThreadingHTTPServer):
+    """The caching mirror of --serve, fills of the cache in progress are shared between clients."""
+
+    def __init__(self, address, packager):
+        super().__init__(address, MirrorHandler)
+        self.config = packager.config
+        self.transport = packager.transport
+        self.fills = {}
+        self.fills_lock = threading.Lock()
+
+    def upstream(self, path):
+        """Map a mirror path (/https/host/path?query) back to the upstream url, None if not allowed."""
+        try:
+            scheme, host, rest = path.lstrip('/').split('/', 2)
+        except ValueError:
+            return None
+        if scheme not in ('http', 'https'):
+            return None
+        hostname = host.split(':')[0].lower()
+        if not (hostname == 'adobe.com' or hostname.endswith('.adobe.com') or host in (self.config.serveAllowHost or [])):
+            return None
+        return '{}://{}/{}'.format(scheme, host, rest)
+
+    def fill(self, key, upstream, headers, fill):
+        """Fetch upstream into the mirror cache, waking clients as bytes arrive."""
+        body_path = os.path.join(self.config.cacheDir, 'mirror', key)
+        try:
+            # The cache holds the body as sent, sizes and ranges must count the same bytes
+            headers = dict(headers, **{'Accept-Encoding': 'identity'})
+            response = self.transport.request('get', upstream, headers=headers, stream=True)
+            fill.status = response.status_code
+            fill.headers = {k: response.headers[k] for k in ('content-type', 'etag', 'last-modified') if k in response.headers}
+            if response.status_code != 200:
+                fill.body = response.content
+                return
+            if 'content-length' in response.headers:
+                fill.size = int(response.headers['content-length'])
+            with open(fill.part_path, 'wb') as f:
+                fill.started.set()
+                for data in response.iter_content(SEGMENT_BLOCK_SIZE):
+                    f.write(data)
+                    f.flush()
+                    with fill.progress:
+                        fill.written += len(data)
+                        fill.progress.notify_all()
+            if fill.size is not None and os.path.getsize(fill.part_path) != fill.size:
+                raise DownloadError('upstream sent {} of {} bytes'.format(os.path.getsize(fill.part_path), fill.size))
+            fill.size = os.path.getsize(fill.part_path)
+            os.replace(fill.part_path, body_path)
+            meta = dict(fill.headers, url=upstream, size=fill.size, fetched=time.time())
+            write_file_atomic(body_path + '.meta.json', json.dumps(meta).encode('utf-8'))
+        except (requests.exceptions.RequestException, DownloadError, OSError) as e:
+            print('Mirror: fetching {} failed: {}'.format(upstream, e))
+            fill.error = e
+            if os.path.isfile(fill.part_path):
+                os.remove(fill.part_path)
+        finally:
+            with fill.progress:
+                fill.done = True
+                fill.progress.notify_all()
+            fill.started.set()
+            with self.fills_lock:
+                self.fills.pop(key, None)
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    """Serve Adobe feeds, manifests and packages from the mirror cache, filling it on a miss."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_mirror(head=True)
+
+    def do_GET(self):
+        self.handle_mirror(head=False)
+
+    def handle_mirror(self, head):
+        config = self.server.config
+        upstream = self.server.upstream(self.path)
+        if not upstream:
+            self.send_error(404, 'Not a mirrored url')
+            return
+        headers = {h: self.headers[h] for h in MIRROR_FORWARD_HEADERS if self.headers.get(h)}
+        key_source = upstream + '\n' + headers.get('x-adobe-build-guid', '')
+        key = hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+        body_path = os.path.join(config.cacheDir, 'mirror', key)
+        meta = None
+        if os.path.isfile(body_path + '.meta.json'):
+            with open(body_path + '.meta.json') as f:
+                meta = json.load(f)
+            # Packages and manifests never change, only the feeds (with a query) expire
+            if '?' in upstream and time.time() - meta['fetched'] >= config.cacheTTL:
+                meta = None
+        if meta and os.path.isfile(body_path):
+            if meta.get('etag') and self.headers.get('If-None-Match') == meta['etag']:
+                self.send_response(304)
+                self.send_header('ETag', meta['etag'])
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            with open(body_path, 'rb') as f:
+                self.send_body(f, meta['size'], meta, head)
+            return
+
+        with self.server.fills_lock:
+            fill = self.server.fills.get(key)
+            if fill is None:
+                os.makedirs(os.path.join(config.cacheDir, 'mirror'), exist_ok=True)
+                fill = self.server.fills[key] = MirrorFill('{}.{}.part'.format(body_path, threading.get_ident()))
+                threading.Thread(target=self.server.fill, args=(key, upstream, headers, fill), daemon=True).start()
+        fill.started.wait()
+        if fill.error and fill.status is None:
+            self.send_error(502, 'Upstream fetch failed')
+            return
+        if fill.status != 200:
+            self.send_response(fill.status)
+            self.send_header('Content-Length', str(len(fill.body)))
+            self.end_headers()
+            if not head:
+                self.wfile.write(fill.body)
+            return
+        size, response_headers = fill.size, fill.headers
+        try:
+            f = open(fill.part_path, 'rb')
+        except FileNotFoundError:
+            # Already complete and moved into the cache, or removed after a failed fetch
+            try:
+                f = open(body_path, 'rb')
+            except FileNotFoundError:
+                self.send_error(502, 'Upstream fetch failed')
+                return
+            fill, size = None, os.fstat(f.fileno()).st_size
+        with f:
+            self.send_body(f, size, response_headers, head, fill)
+
+    def send_body(self, f, size, meta, head, fill=None):
+        """Send f or a requested range of it, following the part file while it is filled."""
+        start, end = 0, None if size is None else size - 1
+        status = 200
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', '').strip())
+        if match and size is not None and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), size - 1)
+            else:
+                start = max(size - int(match.group(2)), 0)
+            if start >= size or start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+        self.send_response(status)
+        self.send_header('Accept-Ranges', 'bytes')
+        for k in ('content-type', 'etag', 'last-modified'):
+            if meta.get(k):
+                self.send_header(k, meta[k])
+        if size is None:
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        else:
+            self.send_header('Content-Length', str(end - start + 1))
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+        self.end_headers()
+        if head:
+            return
+        offset = start
+        f.seek(start)
+        while end is None or offset <= end:
+            if fill:
+                fill.wait_for(offset)
+            data = f.read(SEGMENT_BLOCK_SIZE if end is None else min(SEGMENT_BLOCK_SIZE, end + 1 - offset))
+            if not data:
+                if not fill or fill.done:
+                    break
+                continue
+            self.wfile.write(data)
+            offset += len(data)
+        if fill and fill.error:
+            self.close_connection = True
+
+
+class BuildDaemon:
+    """Build jobs submitted over HTTP with one warm Packager, see --daemon.
+
+    Jobs wait in a bounded queue for --daemonWorkers workers. A job identical
+    to one still queued or running is not added again, the submitter gets the
+    id of the existing one. The catalog is refreshed every --catalogRefresh
+    seconds in the background."""
+
+    def __init__(self, packager):
+        self.packager = packager
+        self.config = packager.config
+        self.metrics = packager.metrics
+        self.queue = queue.Queue(maxsize=self.config.daemonQueueSize)
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.inflight = {}
+        self.running = 0
+        self.next_id = 1
+        self.started = time.time()
+        self.refreshed = None
+        self.samples = deque(maxlen=DAEMON_RATE_SAMPLES)
+        self.install_locks = {}
+        self.stop = threading.Event()
+
+    def selected_version(self, job):
+        urlVersion = str(job.get('urlVersion') or self.config.urlVersion or 6)
+        selectedVersion = parse_url_version(urlVersion)
+        if not selectedVersion:
+            raise JobError('Invalid URL version "{}"'.format(urlVersion))
+        return selectedVersion
+
+    def job_key(self, job):
+        """What makes two jobs the same build, with codes and architectures normalised."""
+        key = dict(job)
+        key['sapCode'] = str(job.get('sapCode', '')).upper()
+        key['urlVersion'] = self.selected_version(job)
+        arch = job.get('arch') or self.config.arch or platform.machine()
+        archs = parse_archs(str(arch))
+        if archs is None:
+            raise JobError('Invalid architecture "{}"'.format(arch))
+        key['arch'] = 'all' if len(archs) > 1 else 'arm64' if archs[0] else 'x64'
+        for name in ('installLanguage', 'osLanguage'):
+            if job.get(name):
+                key[name] = format_language(job[name])
+        return json.dumps(key, sort_keys=True)
+
+    def submit(self, job):
+        """Queue a job, returns (its record, False) or (the identical job in flight, True).
+
+        Raises JobError for a malformed job and queue.Full when the queue is full."""
+        if not isinstance(job, dict) or not job.get('sapCode'):
+            raise JobError('A job needs at least a sapCode')
+        key = self.job_key(job)
+        with self.lock:
+            record = self.inflight.get(key)
+            if record is not None:
+                self.metrics.add('daemonDeduplicatedJobs')
+                return record, True
+            record = {'id': str(self.next_id), 'job': job, 'status': 'queued', 'submitted': time.time(),
+                      'started': None, 'finished': None, 'installer': None, 'error': None}
+            self.queue.put_nowait(record)
+            self.next_id += 1
+            self.jobs[record['id']] = record
+            self.inflight[key] = record
+            record['key'] = key
+            while len(self.jobs) > DAEMON_JOB_HISTORY and next(iter(self.jobs.values()))['finished']:
+                self.jobs.popitem(last=False)
+        self.metrics.add('daemonJobs')
+        return record, False
+
+    def install_lock(self, install_app_path):
+        """Lock serialising builds of one installer, different jobs can end up at the same path."""
+        with self.lock:
+            return self.install_locks.setdefault(install_app_path, threading.Lock())
+
+    def build(self, record):
+        """Plan and build the installers of a job, returns True if they are complete.
+
+        A job for both architectures downloads their shared packages once."""
+        selectedVersion = self.selected_version(record['job'])
+        builds = OrderedDict()
+        for job in self.packager.resolver.expand_job(record['job']):
+            build = self.packager.resolver.plan_job(job, selectedVersion)
+            if build.get('apro'):
+                record['installer'] = build['dest']
+                return self.packager.download_APRO(build['prodInfo'], build['cdn'], build['dest'])
+            builds.setdefault(build['install_app_path'], build)
+        paths = list(builds)
+        record['installer'] = paths[0] if len(paths) == 1 else paths
+        with ExitStack() as stack:
+            # In path order, so that two jobs sharing installers can't wait for each other
+            for path in sorted(paths):
+                stack.enter_context(self.install_lock(path))
+            return self.packager.build_installers(list(builds.values())) == 0
+
+    def work(self):
+        while True:
+            record = self.queue.get()
+            with self.lock:
+                record['status'] = 'running'
+                record['started'] = time.time()
+                self.running += 1
+            try:
+                complete = self.build(record)
+                error = None if complete else 'Some packages failed to download'
+            except Exception as e:  # A broken job must not take its worker down
+                print('Job {} failed: {}'.format(record['id'], e))
+                error = str(e)
+            with self.lock:
+                record['status'] = 'failed' if error else 'done'
+                record['error'] = error
+                record['finished'] = time.time()
+                self.running -= 1
+                self.inflight.pop(record['key'], None)
+            self.metrics.add('daemonFailedJobs' if error else 'daemonCompletedJobs')
+
+    def keep_catalog_fresh(self):
+        """Load the catalog of both architectures, then refresh it every --catalogRefresh seconds.
+
+        Wakes up every few seconds to sample the download rate for status()."""
+        try:
+            selectedVersion = self.selected_version({})
+            for ism1 in (False, True):
+                self.packager.catalog.get(selectedVersion, get_allowed_platforms(ism1))
+            self.refreshed = time.time()
+        except (JobError, CacheMiss, requests.exceptions.RequestException) as e:
+            print('Could not load the catalog: {}'.format(e))
+        rate_limiter = self.packager.transport.rate_limiter
+        while not self.stop.wait(DAEMON_SAMPLE_INTERVAL):
+            with self.lock:
+                self.samples.append((time.monotonic(), rate_limiter.transferred))
+            if self.config.catalogRefresh and time.time() - (self.refreshed or 0) >= self.config.catalogRefresh:
+                try:
+                    replaced = self.packager.catalog.refresh()
+                    self.refreshed = time.time()
+                    if replaced:
+                        print('Catalog refreshed, {} catalogs changed'.format(replaced))
+                        self.metrics.add('catalogRefreshes')
+                except (CacheMiss, requests.exceptions.RequestException) as e:
+                    print('Could not refresh the catalog: {}'.format(e))
+
+    def job_status(self, record):
+        status = {k: record[k] for k in ('id', 'job', 'status', 'installer', 'error')}
+        for k in ('submitted', 'started', 'finished'):
+            status[k] = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record[k])) if record[k] else None
+        if record['started']:
+            status['seconds'] = round((record['finished'] or time.time()) - record['started'], 3)
+        return status
+
+    def status(self):
+        """Queue, workers, catalog age and download throughput."""
+        with self.lock:
+            counts = {}
+            for record in self.jobs.values():
+                counts[record['status']] = counts.get(record['status'], 0) + 1
+            samples = list(self.samples)
+            running = self.running
+        rate = 0
+        if len(samples) > 1:
+            rate = (samples[-1][1] - samples[0][1]) / (samples[-1][0] - samples[0][0])
+        report = self.metrics.report()
+        return {
+            'version': VERSION_STR,
+            'uptimeSeconds': round(time.time() - self.started, 3),
+            'workers': self.config.daemonWorkers,
+            'running': running,
+            'queued': self.queue.qsize(),
+            'jobs': counts,
+            'catalogRefreshed': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.refreshed)) if self.refreshed else None,
+            'downloadedBytes': self.packager.transport.rate_limiter.transferred,
+            'downloadMBPerSecond': round(rate / 1e6, 2),
+            'counters': report['counters'],
+            'spans': report['spans'],
+        }
+
+    def serve(self, address):
+        """Accept jobs on [host:]port until interrupted."""
+        host, _, port = address.rpartition(':')
+        server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), DaemonHandler)
+        server.build_daemon = self
+        for _ in range(self.config.daemonWorkers):
+            threading.Thread(target=self.work, daemon=True).start()
+        threading.Thread(target=self.keep_catalog_fresh, daemon=True).start()
+        print('Build daemon on http://{}:{} with {} workers'.format(
+            server.server_address[0], server.server_address[1], self.config.daemonWorkers))
+        print('Submit jobs with POST /jobs {"sapCode": "PHSP", "version": "25.0", "installLanguage": "en_US", "arch": "arm64"}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        self.stop.set()
+        server.server_close()
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    """POST /jobs, GET /jobs, GET /jobs/<id> and GET /status of the build daemon, all JSON."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        daemon = self.server.build_daemon
+        path = urlsplit(self.path).path.rstrip('/')
+        if path == '/status':
+            self.send_json(200, daemon.status())
+        elif path == '/jobs':
+            with daemon.lock:
+                records = list(daemon.jobs.values())
+            self.send_json(200, [daemon.job_status(record) for record in records])
+        elif path.startswith('/jobs/'):
+            record = daemon.jobs.get(path[len('/jobs/'):])
+            if record is None:
+                self.send_json(404, {'error': 'No such job'})
+            else:
+                self.send_json(200, daemon.job_status(record))
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if urlsplit(self.path).path.rstrip('/') != '/jobs':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'null')
+            record, duplicate = self.server.build_daemon.submit(job)
+        except ValueError as e:  # Not JSON, or a JobError
+            self.send_json(400, {'error': str(e)})
+            return
+        except queue.Full:
+            self.send_json(503, {'error': 'The job queue is full'})
+            return
+        self.send_json(200 if duplicate else 202, dict(self.server.build_daemon.job_status(record), duplicate=duplicate))
+
+
+def check_creative_cloud(config):
+    if (config.ignoreNoCreativeCloud):
         print('Not checking Creative Cloud installation, created installer may use a fallback icon if CC is not installed.')
     elif (not os.path.isfile('/Library/Application Support/Adobe/Adobe Desktop Common/HDBox/Setup')):
         print('Adobe HyperDrive installer not found.\nPlease make sure the Creative Cloud app is installed.')
         exit(1)
 
+
+def get_download_path(config, archive=None):
+    """Ask for desired download folder"""
+    if archive:
+        return archive.root
+    if (config.destination):
+        print('\nUsing provided destination: ' + config.destination)
+        dest = config.destination
+    else:
+        print('\nPlease navigate to the desired downloads folder, or cancel to abort.')
+        p = Popen(['/usr/bin/osascript', '-e',
+                  'tell application (path to frontmost application as text)\nset _path to choose folder\nPOSIX path of _path\nend'], stdout=PIPE)
+        dest = p.communicate()[0].decode('utf-8').strip()
+        if (p.returncode != 0):
+            print('Exiting...')
+            exit()
+    return dest
+
+
+@timed('get_products')
+def get_products(packager):
+    config = packager.config
+    check_creative_cloud(config)
+
     selectedVersion = None
-    if args.urlVersion:
-        if args.urlVersion.lower() == "v4" or args.urlVersion == "4":
-            selectedVersion = 4
-        elif args.urlVersion.lower() == "v5" or args.urlVersion == "5":
-            selectedVersion = 5
-        elif args.urlVersion.lower() == "v6" or args.urlVersion == "6":
-            selectedVersion = 6
-        else:
-            print('Invalid argument "{}" for {}'.format(args.urlVersion, 'URL version'))
+    if config.urlVersion:
+        selectedVersion = parse_url_version(config.urlVersion)
+        if not selectedVersion:
+            print('Invalid argument "{}" for {}'.format(config.urlVersion, 'URL version'))
             exit(1)
 
     while not selectedVersion:
-        val = input('\nPlease enter the URL version(v4/v5/v6) for downloading products.xml, or nothing for v6: ') or 'v6'
-        if val == 'v4' or val == '4':
-            selectedVersion = 4
-        elif val == 'v5' or val == '5':
-            selectedVersion = 5
-        elif val == 'v6' or val == '6':
-            selectedVersion = 6
-        else:
+        val = input('\nPlease enter the URL version(v4/v5/v6, or all to merge them) for downloading products.xml, or nothing for v6: ') or 'v6'
+        selectedVersion = parse_url_version(val)
+        if not selectedVersion:
             print('Invalid URL version: {}'.format(val))
     print('')
 
-    if args.Auth:
-        ADOBE_REQ_HEADERS['Authorization'] = args.Auth
-
-    ism1 = -1
-    if args.arch:
-        if args.arch.lower() == 'x86_64' or args.arch.lower() == 'x64' or args.arch.lower() == 'intel':
-            ism1 = False
-        elif args.arch.lower() == 'arm64' or args.arch.lower() == 'arm' or args.arch.lower() == 'm1':
-            ism1 = True
-        else:
-            print('Invalid argument "{}" for {}'.format(args.arch, 'architecture'))
-    if ism1 == -1:
+    archs = None
+    if config.arch:
+        archs = parse_archs(config.arch)
+        if archs is None:
+            print('Invalid argument "{}" for {}'.format(config.arch, 'architecture'))
+    if archs is None:
         if platform.machine() == 'arm64':
-            ism1 = questiony('Do you want to make M1 native packages')
+            archs = [questiony('Do you want to make M1 native packages')]
         else:
-            ism1 = False
-    allowedPlatforms = ['macuniversal']
-    if ism1:
-        allowedPlatforms.append('macarm64')
+            archs = [False]
+    if archs == [True]:
         print('Note: If the Adobe program is NOT listed here, there is no native M1 version.')
         print('      Use the non native version with Rosetta 2 until an M1 version is available.')
-    else:
-        allowedPlatforms.append('osx10-64')
-        allowedPlatforms.append('osx10')
 
-    productsPlatform = 'osx10-64,osx10,macarm64,macuniversal'
-    adobeurl = ADOBE_PRODUCTS_XML_URL.format(urlVersion=selectedVersion, installPlatform=productsPlatform)
-
-    print('\nDownloading products.xml\n')
-    products_xml = get_products_xml(adobeurl)
-
-    print('\nParsing products.xml\n')
-    products, cdn = parse_products_xml(products_xml, selectedVersion, allowedPlatforms)
+    catalogs = []
+    try:
+        for ism1 in archs:
+            allowedPlatforms = get_allowed_platforms(ism1)
+            products, cdn = packager.catalog.get(selectedVersion, allowedPlatforms)
+            catalogs.append((products, cdn, allowedPlatforms))
+    except CacheMiss as e:
+        print(e)
+        exit(1)
 
-    print('CDN: ' + cdn)
+    print('CDN: ' + catalogs[0][1])
     sapCodes = {}
-    for p in products.values():
-        if not p['hidden']:
-            versions = p['versions']
-            version = None
-            lastv = None
-            for v in reversed(versions.values()):
-                if v['buildGuid'] and v['apPlatform'] in allowedPlatforms:
-                    lastv = v['productVersion']
-            if lastv:
+    for products, _, _ in catalogs:
+        for p in products.values():
+            if not p['hidden'] and p['latestVersion']:
                 sapCodes[p['sapCode']] = p['displayName']
     print(str(len(sapCodes)) + ' products found:')
 
-    if args.sapCode and products.get(args.sapCode.upper()) is None:
-        print('\nProvided SAP Code not found in products: ' + args.sapCode)
+    if config.sapCode and not any(products.get(config.sapCode.upper()) for products, _, _ in catalogs):
+        print('\nProvided SAP Code not found in products: ' + config.sapCode)
         exit(1)
 
-    return products, cdn, sapCodes, allowedPlatforms
+    return catalogs, sapCodes
+
 
+@timed('run_ccdl')
+def run_ccdl(packager, catalogs, sapCodes, archive=None):
+    """Run Main exicution.
 
-def run_ccdl(products, cdn, sapCodes, allowedPlatforms):
-    """Run Main exicution."""
-    sapCode = args.sapCode
+    catalogs holds (products, cdn, allowedPlatforms) for each architecture,
+    with --arch all there are two and an installer is built for each of
+    them from one download of their packages. Returns the number of
+    installers that are incomplete."""
+    config = packager.config
+    sapCode = config.sapCode
     if not sapCode:
         for s, d in sapCodes.items():
             print('[{}]{}{}'.format(s, (10 - len(s)) * ' ', d))
@@ -524,55 +3224,81 @@ def run_ccdl(products, cdn, sapCodes, allowedPlatforms):
         while sapCode is None:
             val = input(
                 '\nPlease enter the SAP Code of the desired product (eg. PHSP for Photoshop): ').upper() or 'PHSP'
-            if products.get(val):
+            if any(products.get(val) for products, _, _ in catalogs):
                 sapCode = val
             else:
                 print(
                     '{} is not a valid SAP Code. Please use a value from the list above.'.format(val))
 
-    product = products.get(sapCode)
-    versions = product['versions']
+    # (products, product, cdn, allowedPlatforms) of the architectures that have the product
+    variants = [(products, products[sapCode], cdn, allowedPlatforms)
+                for products, cdn, allowedPlatforms in catalogs if products.get(sapCode)]
+    product = variants[0][1]
     version = None
-    if (args.version):
-        if versions.get(args.version):
-            print('\nUsing provided version: ' + args.version)
-            version = args.version
+    if (config.version):
+        if any(v[1]['versions'].get(config.version) for v in variants):
+            print('\nUsing provided version: ' + config.version)
+            version = config.version
         else:
-            print('\nProvided version not found: ' + args.version)
+            print('\nProvided version not found: ' + config.version)
 
     print('')
 
     if not version:
-        lastv = None
-        for v in reversed(versions.values()):
+        lastv = next(v[1]['latestVersion'] for v in variants if v[1]['latestVersion'])
+        listed = set()
+        for _, p, _, allowedPlatforms in variants:
+            for v in reversed(p['versions'].values()):
 
-            if v['buildGuid'] and v['apPlatform'] in allowedPlatforms:
-                print('{} Platform: {} - {}'.format(product['displayName'], v['apPlatform'], v['productVersion']))
-                lastv = v['productVersion']
+                if v['buildGuid'] and v['apPlatform'] in allowedPlatforms and (v['productVersion'], v['apPlatform']) not in listed:
+                    listed.add((v['productVersion'], v['apPlatform']))
+                    feeds = ' ({})'.format(', '.join('v{}'.format(f) for f in v['feeds'])) if 'feeds' in v else ''
+                    print('{} Platform: {} - {}{}'.format(product['displayName'], v['apPlatform'], v['productVersion'], feeds))
 
         while version is None:
             val = input('\nPlease enter the desired version. Nothing for ' + lastv + ': ') or lastv
-            if versions.get(val):
+            if any(v[1]['versions'].get(val) for v in variants):
                 version = val
             else:
                 print('{} is not a valid version. Please use a value from the list above.'.format(val))
     print('')
+    selected = []
+    for products, cdn, allowedPlatforms in catalogs:
+        prodInfo = products.get(sapCode, {}).get('versions', {}).get(version)
+        if prodInfo and prodInfo['apPlatform'] in allowedPlatforms:
+            selected.append((products, prodInfo, prodInfo.get('cdn', cdn)))
+        elif len(catalogs) > 1:
+            print('{} {} has no {} build, skipping it'.format(
+                product['displayName'], version, 'arm64' if 'macarm64' in allowedPlatforms else 'x64'))
+    if not selected:
+        products, p, cdn, _ = next(v for v in variants if v[1]['versions'].get(version))
+        selected.append((products, p['versions'][version], p['versions'][version].get('cdn', cdn)))
 
     if sapCode == 'APRO':
-        download_APRO(versions[version], cdn)
-        return
-
-    # TODO: Parase languages in the xml
-    langs = ['en_US', 'en_GB', 'en_IL', 'en_AE', 'es_ES', 'es_MX', 'pt_BR', 'fr_FR', 'fr_CA', 'fr_MA', 'it_IT', 'de_DE', 'nl_NL',
-             'ru_RU', 'uk_UA', 'zh_TW', 'zh_CN', 'ja_JP', 'ko_KR', 'pl_PL', 'hu_HU', 'cs_CZ', 'tr_TR', 'sv_SE', 'nb_NO', 'fi_FI', 'da_DK', 'ALL']
+        seen = set()
+        incomplete = 0
+        for _, prodInfo, cdn in selected:
+            if prodInfo['buildGuid'] in seen:
+                continue
+            seen.add(prodInfo['buildGuid'])
+            if config.plan:
+                packager.plan_APRO(prodInfo, cdn)
+            elif not packager.download_APRO(prodInfo, cdn, get_download_path(config, archive), archive):
+                incomplete += 1
+        return incomplete
+
+    langs = packager.catalog.product_languages(selected[0][1])
+    for _, prodInfo, _ in selected[1:]:
+        other = packager.catalog.product_languages(prodInfo)
+        langs = [lang for lang in langs if lang in other]
     # Detecting Current set default Os language. Fixed.
     deflocal = locale.getlocale()[0]
     if not deflocal:
         deflocal = 'en_US'
 
     oslang = None
-    if args.osLanguage:
-        oslang = args.osLanguage
+    if config.osLanguage:
+        oslang = config.osLanguage
     elif deflocal:
         oslang = deflocal
 
@@ -582,22 +3308,18 @@ def run_ccdl(products, cdn, sapCodes, allowedPlatforms):
         deflang = 'en_US'
 
     installLanguage = None
-    if args.installLanguage:
-        if args.installLanguage in langs:
-            print('\nUsing provided language: ' + args.installLanguage)
-            installLanguage = args.installLanguage
+    if config.installLanguage:
+        if config.installLanguage in langs:
+            print('\nUsing provided language: ' + config.installLanguage)
+            installLanguage = config.installLanguage
         else:
-            print('\nProvided language not available: ' + args.installLanguage)
+            print('\nProvided language not available: ' + config.installLanguage)
 
     if not installLanguage:
         print('Available languages: {}'.format(', '.join(langs)))
         while installLanguage is None:
-            val = input(
-                f'\nPlease enter the desired install language, or nothing for [{deflang}]: ') or deflang
-            if len(val) == 5:
-                val = val[0:2].lower() + val[2] + val[3:5].upper()
-            elif len(val) == 3:
-                val = val.upper()
+            val = format_language(input(
+                f'\nPlease enter the desired install language, or nothing for [{deflang}]: ') or deflang)
             if val in langs:
                 installLanguage = val
             else:
@@ -613,141 +3335,38 @@ def run_ccdl(products, cdn, sapCodes, allowedPlatforms):
                     print(
                         '{} is not available. Please use a value from the list above.'.format(oslang))
 
-    dest = get_download_path()
+    dest = get_download_path(config, archive)
 
     print('')
 
-    prodInfo = versions[version]
-    prods_to_download = []
-    dependencies = prodInfo['dependencies']
-    for d in dependencies:
-        firstArch = firstGuid = buildGuid = None
-        for p in products[d['sapCode']]['versions']:
-            if products[d['sapCode']]['versions'][p]['baseVersion'] == d['version']:
-                if not firstGuid:
-                    firstGuid = products[d['sapCode']]['versions'][p]['buildGuid']
-                    firstArch = products[d['sapCode']]['versions'][p]['apPlatform']
-                if products[d['sapCode']]['versions'][p]['apPlatform'] in allowedPlatforms:
-                    buildGuid = products[d['sapCode']]['versions'][p]['buildGuid']
-                    break
-        if not buildGuid:
-            buildGuid = firstGuid
-        prods_to_download.append({'sapCode': d['sapCode'], 'version': d['version'],
-                                  'buildGuid': buildGuid})
-
-    prods_to_download.insert(
-        0, {'sapCode': prodInfo['sapCode'], 'version': prodInfo['productVersion'], 'buildGuid': prodInfo['buildGuid']})
-    apPlatform = prodInfo['apPlatform']
-    install_app_name = 'Install {}_{}-{}-{}.app'.format(
-        sapCode, version, installLanguage, apPlatform)
-    install_app_path = os.path.join(dest, install_app_name)
+    builds = OrderedDict()
+    for products, prodInfo, cdn in selected:
+        build = plan_installer(products, cdn, prodInfo, installLanguage, oslang, dest, config.fromApp)
+        # A macuniversal build is the same installer for both architectures
+        builds.setdefault(build['install_app_path'], build)
+    builds = list(builds.values())
     print('sapCode: ' + sapCode)
     print('version: ' + version)
     print('installLanguage: ' + installLanguage)
-    print('dest: ' + install_app_path)
-    print(prods_to_download)
-
-    print('\nCreating {}'.format(install_app_name))
-
-    with Popen(['/usr/bin/osacompile', '-l', 'JavaScript', '-o', os.path.join(dest, install_app_path)], stdin=PIPE) as p:
-        p.communicate(INSTALL_APP_APPLE_SCRIPT.encode('utf-8'))
-
-    if os.path.isfile(ADOBE_CC_MAC_ICON_PATH):
-        icon_path = ADOBE_CC_MAC_ICON_PATH
-    else:
-        icon_path = MAC_VOLUME_ICON_PATH
-    shutil.copyfile(icon_path, os.path.join(install_app_path,
-                    'Contents', 'Resources', 'applet.icns'))
-
-    products_dir = os.path.join(
-        install_app_path, 'Contents', 'Resources', 'products')
-
-    print('\nPreparing...\n')
-
-    for p in prods_to_download:
-        s, v = p['sapCode'], p['version']
-        product_dir = os.path.join(products_dir, s)
-        app_json_path = os.path.join(product_dir, 'application.json')
+    for build in builds:
+        print('dest: ' + build['install_app_path'])
+        print(build['prods_to_download'])
 
-        print('[{}_{}] Downloading application.json'.format(s, v))
-        app_json = get_application_json(p['buildGuid'])
-        p['application_json'] = app_json
-
-        print('[{}_{}] Creating folder for product'.format(s, v))
-        os.makedirs(product_dir, exist_ok=True)
-
-        print('[{}_{}] Saving application.json'.format(s, v))
-        with open(app_json_path, 'w') as file:
-            json.dump(app_json, file, separators=(',', ':'))
-
-        print('')
-
-    print('Downloading...\n')
-
-    for p in prods_to_download:
-        s, v = p['sapCode'], p['version']
-        app_json = p['application_json']
-        product_dir = os.path.join(products_dir, s)
-
-        print('[{}_{}] Parsing available packages'.format(s, v))
-        core_pkg_count = 0
-        noncore_pkg_count = 0
-        packages = app_json['Packages']['Package']
-        download_urls = []
-        for pkg in packages:
-            if pkg.get('Type') and pkg['Type'] == 'core':
-                core_pkg_count += 1
-                download_urls.append(cdn + pkg['Path'])
-            else:
-                # TODO: actually parse `Condition` and check it properly (and maybe look for & add support for conditions other than installLanguage)
-                language_is_suitable = (
-                        installLanguage == "ALL"
-                        or 'Condition' not in pkg
-                        or '[installLanguage]' not in pkg['Condition']
-                        or '[installLanguage]==' + installLanguage in pkg['Condition']
-                        or '[installLanguage]==' + oslang in pkg['Condition']
-                )
+    if config.plan:
+        return 0 if packager.report_plan(builds) else 1
 
-                if language_is_suitable:
-                    noncore_pkg_count += 1
-                    download_urls.append(cdn + pkg['Path'])
+    return packager.build_installers(builds, archive)
 
-        print('[{}_{}] Selected {} core packages and {} non-core packages'.format(s,
-              v, core_pkg_count, noncore_pkg_count))
-
-        for url in download_urls:
-            download_file(url, product_dir, s, v)
-
-    print('\nGenerating driver.xml')
-
-    driver = DRIVER_XML.format(
-        name=product['displayName'],
-        sapCode=prodInfo['sapCode'],
-        version=prodInfo['productVersion'],
-        installPlatform=apPlatform,
-        dependencies='\n'.join([DRIVER_XML_DEPENDENCY.format(
-            sapCode=d['sapCode'],
-            version=d['version']
-        ) for d in prodInfo['dependencies']]),
-        language=installLanguage
-    )
-
-    with open(os.path.join(products_dir, 'driver.xml'), 'w') as f:
-        f.write(driver)
-        f.close()
-
-    print('\nPackage successfully created. Run {} to install.'.format(install_app_path))
-    return
-
-
-if __name__ == '__main__':
-    show_version()
 
+def parse_args(argv=None):
+    """Parse and check the command line, argv defaults to sys.argv."""
     parser = argparse.ArgumentParser()
     parser.add_argument('-l', '--installLanguage',
                         help='Language code (eg. en_US)', action='store')
     parser.add_argument('-o', '--osLanguage',
                         help='OS Language code (eg. en_US)', action='store')
+    parser.add_argument('--osVersion',
+                        help='macOS version the installer is for, packages whose conditions need another version are left out (default: keep all)', action='store')
     parser.add_argument('-s', '--sapCode',
                         help='SAP code for desired product (eg. PHSP)', action='store')
     parser.add_argument('-v', '--version',
@@ -755,9 +3374,9 @@ if __name__ == '__main__':
     parser.add_argument('-d', '--destination',
                         help='Directory to download installation files to', action='store')
     parser.add_argument('-a', '--arch',
-                        help='Set the architecture to download', action='store')
+                        help='Set the architecture to download (arm64 or x64), or all to build both installers from one download', action='store')
     parser.add_argument('-u', '--urlVersion',
-                        help="Get app info from v4/v5/v6 url (eg. v6)", action='store')
+                        help="Get app info from v4/v5/v6 url (eg. v6), or all to merge the three feeds", action='store')
     parser.add_argument('-A', '--Auth',
                         help='Add a bearer_token to to authenticate your account, e.g. downloading Xd', action='store')
     parser.add_argument('--ignoreNoCreativeCloud',
@@ -766,11 +3385,169 @@ if __name__ == '__main__':
                         help="Don't prompt for additional downloads", action='store_true')
     parser.add_argument('--skipExisting',
                         help="Skip existing files, e.g. resuming failed downloads", action='store_true')
-    args = parser.parse_args()
+    parser.add_argument('-j', '--jobs',
+                        help='Number of packages to download in parallel (default: 4)', type=int, default=4)
+    parser.add_argument('--segments',
+                        help='Split files larger than 64 MiB into N parallel range requests (default: 1)', type=int, default=1)
+    parser.add_argument('--cacheDir',
+                        help='Directory for cached products.xml and application.json files (default: {})'.format(DEFAULT_CACHE_DIR), action='store', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--cacheTTL',
+                        help='Seconds a cached products.xml is used before it is revalidated (default: 900)', type=int, default=900)
+    parser.add_argument('--offline',
+                        help='Only use the cache, never fetch products.xml or application.json', action='store_true')
+    parser.add_argument('--appJsonCacheSize',
+                        help='Size limit of the application.json cache in MB (default: 200)', type=int, default=200)
+    parser.add_argument('--store',
+                        help='Shared package store, downloaded packages are hardlinked into the installers from here', action='store')
+    parser.add_argument('--storeMaxSize',
+                        help='Size limit of the package store in GB, least recently used packages are removed (default: no limit)', type=int, default=0)
+    parser.add_argument('--batch',
+                        help='Build every installer listed in a JSON manifest without prompting', action='store')
+    parser.add_argument('--plan',
+                        help='Only report packages, download sizes and free disk space, do not create the installer', action='store_true')
+    parser.add_argument('--serve',
+                        help='Run a caching mirror of the Adobe servers on [host:]port instead of building', action='store')
+    parser.add_argument('--serveAllowHost',
+                        help='Additional upstream host:port the mirror may fetch from (repeatable)', action='append')
+    parser.add_argument('--daemon',
+                        help='Run a build daemon accepting jobs over HTTP on [host:]port instead of building', action='store')
+    parser.add_argument('--daemonWorkers',
+                        help='Jobs the daemon builds at the same time (default: 2)', type=int, default=2)
+    parser.add_argument('--daemonQueueSize',
+                        help='Jobs the daemon accepts before refusing new ones (default: 100)', type=int, default=100)
+    parser.add_argument('--catalogRefresh',
+                        help='Seconds between background refreshes of products.xml in the daemon, 0 to never refresh (default: 900)', type=int, default=900)
+    parser.add_argument('--mirror',
+                        help='Fetch everything through a mirror started with --serve (eg. http://buildhost:8080)', action='store')
+    parser.add_argument('--metrics-out',
+                        help='Write per-phase timings, byte counters and time-to-first-byte to a JSON file', action='store')
+    parser.add_argument('--profile',
+                        help='Run under cProfile, write the stats to FILE (default: ccdl.prof) and print the top functions',
+                        nargs='?', const='ccdl.prof', metavar='FILE')
+    parser.add_argument('--bufferSize',
+                        help='Size of the read buffers of every connection, e.g. 256K, 4M (default: 1M)', type=parse_size, default=DEFAULT_BUFFER_SIZE)
+    parser.add_argument('--max-rate',
+                        help='Limit the total download rate, e.g. 500K, 20M (default: unlimited)', type=parse_rate, default=0)
+    parser.add_argument('--rate-window',
+                        help='Use another rate limit between two times of day, e.g. 09:00-18:00=5M or 18:00-09:00=0 for unlimited, can be repeated',
+                        type=parse_rate_window, action='append', metavar='HH:MM-HH:MM=RATE')
+    parser.add_argument('--order',
+                        help='Order of the download queue (default: manifest)', choices=DOWNLOAD_ORDERS, default='manifest')
+    parser.add_argument('--progress',
+                        help='Show the download progress as one bar, as JSON lines events on stdout with the messages on stderr, or not at all (default: bar)',
+                        choices=PROGRESS_MODES, default='bar')
+    parser.add_argument('--retries',
+                        help='Retries for connection errors, timeouts and 5xx answers before a request fails (default: 5)', type=int, default=5)
+    parser.add_argument('--retryBackoff',
+                        help='Initial retry delay in seconds, doubled on every retry (default: 1)', type=float, default=1.0)
+    parser.add_argument('--connectTimeout',
+                        help='Seconds to wait for a connection (default: 10)', type=float, default=10)
+    parser.add_argument('--readTimeout',
+                        help='Seconds to wait for data on an open connection (default: 60)', type=float, default=60)
+    parser.add_argument('--archive', metavar='FILE',
+                        help='Write the installers into one tar archive instead of a folder, .tar.zst and .tar.gz are compressed, - writes to stdout', action='store')
+    parser.add_argument('--archiveCompression',
+                        help='Compression of the --archive (default: from the file extension, none for stdout)', choices=('none', 'zst', 'gz'))
+    parser.add_argument('--verify',
+                        help='Check the zip structure of every package after the download', action='store_true')
+    parser.add_argument('--verifyFull',
+                        help='Also decompress every package and check its CRC-32, on all CPUs', action='store_true')
+    parser.add_argument('--verifyApp', metavar='APP',
+                        help='Only check the packages of an existing installer .app (repeatable), with --verifyFull also their CRC-32. Pass the --osVersion it was built for, if any', action='append')
+    parser.add_argument('--from', dest='fromApp', metavar='APP',
+                        help='Previous installer .app of the product, unchanged packages are linked from it instead of downloaded', action='store')
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.segments < 1:
+        parser.error('--segments must be at least 1')
+    if args.bufferSize < 4096:
+        parser.error('--bufferSize must be at least 4K')
+    if args.daemonWorkers < 1:
+        parser.error('--daemonWorkers must be at least 1')
+    if args.daemonQueueSize < 1:
+        parser.error('--daemonQueueSize must be at least 1')
+    if args.retries < 0:
+        parser.error('--retries can not be negative')
+    if args.archive and archive_compression(args.archive, args.archiveCompression) == 'zst' and not shutil.which('zstd'):
+        parser.error('--archive with zstd compression needs the zstd command')
+    if args.archive == '-' and args.progress == 'jsonl':
+        parser.error('--progress jsonl and --archive - can not both write to stdout')
+    if args.fromApp and not os.path.isdir(os.path.join(args.fromApp, 'Contents', 'Resources', 'products')):
+        parser.error('--from must be an installer created by this script')
+    for app in args.verifyApp or []:
+        if not os.path.isdir(os.path.join(app, 'Contents', 'Resources', 'products')):
+            parser.error('--verifyApp must be an installer created by this script: ' + app)
+    return args
+
+
+def write_profile(profiler, path):
+    profiler.dump_stats(path)
+    print('\nProfile written to {}, top functions by cumulative time:\n'.format(path))
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+
+def run(packager):
+    """Run the mode selected on the command line, returns the exit status."""
+    config = packager.config
+    if config.serve:
+        packager.serve(config.serve)
+        return 0
+    if config.verifyApp:
+        broken = sum(packager.verify_installer(app) for app in config.verifyApp)
+        return 1 if broken else 0
+    if config.daemon:
+        check_creative_cloud(config)
+        BuildDaemon(packager).serve(config.daemon)
+        return 0
+
+    archive = None
+    if config.archive and not config.plan:
+        archive = ArchiveWriter(config.archive, archive_compression(config.archive, config.archiveCompression))
+    status = 1
+    try:
+        if config.batch:
+            check_creative_cloud(config)
+            status = 1 if packager.run_batch(load_batch_manifest(config.batch), archive) else 0
+            return status
+
+        catalogs, sapCodes = get_products(packager)
+
+        incomplete = 0
+        while True:
+            incomplete += run_ccdl(packager, catalogs, sapCodes, archive)
+            if config.noRepeatPrompt or not questiony('\n\nDo you want to create another package'):
+                break
+        status = 1 if incomplete else 0
+        return status
+    finally:
+        if archive:
+            archive.close(complete=status == 0)
+
+
+def main(config):
+    packager = Packager(config)
+    try:
+        return run(packager)
+    finally:
+        if config.metrics_out:
+            packager.metrics.write(config.metrics_out)
+
 
-    products, cdn, sapCodes, allowedPlatforms = get_products()
+if __name__ == '__main__':
+    config = parse_args()
+    if config.archive == '-' or config.progress == 'jsonl':
+        # stdout carries the archive or the progress events, messages go to stderr
+        sys.stdout = sys.stderr
+    show_version()
 
-    while True:
-        run_ccdl(products, cdn, sapCodes, allowedPlatforms)
-        if args.noRepeatPrompt or not questiony('\n\nDo you want to create another package'):
-            break
+    profiler = cProfile.Profile() if config.profile else None
+    if profiler:
+        profiler.enable()
+    try:
+        status = main(config)
+    finally:
+        if profiler:
+            profiler.disable()
+            write_profile(profiler, config.profile)
+    sys.exit(status)
@@ -0,0 +1,229 @@
+"""Regression checks for the download paths of ccdl.py, no network needed."""
+import gzip
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import urllib3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ccdl  # noqa: E402
+
+BODY = bytes(range(256)) * 64
+
+
+class DroppingRaw:
+    """response.raw sending size bytes from offset, then a connection reset if drop is set."""
+
+    def __init__(self, data, drop):
+        self.data = data
+        self.drop = drop
+        self.decode_content = False
+
+    def readinto(self, buf):
+        if not self.data:
+            if self.drop:
+                raise urllib3.exceptions.ProtocolError('Connection reset by peer')
+            return 0
+        n = min(len(buf), len(self.data))
+        buf[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n
+
+
+class FakeResponse:
+    def __init__(self, status_code, data, drop, headers=None):
+        self.status_code = status_code
+        self.raw = DroppingRaw(data, drop)
+        self.headers = headers or {}
+        self.elapsed = None
+
+    def raise_for_status(self):
+        pass
+
+
+def packager(**options):
+    options.setdefault('retryBackoff', 0)
+    options.setdefault('progress', 'none')
+    return ccdl.Packager(bufferSize=4096, **options)
+
+
+def test_range_survives_more_drops_than_buffers(tmp_path):
+    """Every attempt loses its connection after 1 KiB, more often than there are buffers."""
+    p = packager()
+    requests_made = []
+
+    def request(method, url, headers=None, **kwargs):
+        start, end = (int(x) for x in headers['Range'][len('bytes='):].split('-'))
+        requests_made.append(start)
+        data = BODY[start:end + 1]
+        return FakeResponse(206, data[:1024], drop=len(data) > 1024)
+
+    p.transport.request = request
+    p.metrics.add_ttfb = lambda response: None
+    path = str(tmp_path / 'pkg.zip')
+    with open(path, 'wb') as f:
+        f.truncate(len(BODY))
+    fd = os.open(path, os.O_WRONLY)
+    errors = []
+
+    def run():
+        try:
+            p.downloader.download_range('http://cdn/pkg.zip', fd, 0, len(BODY) - 1,
+                                        ccdl.ProgressFile('P', '1', 'pkg.zip', len(BODY)))
+        except Exception as e:
+            errors.append(e)
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    worker.join(30)
+    os.close(fd)
+    assert not worker.is_alive(), 'download_range hung after {} requests'.format(len(requests_made))
+    assert not errors
+    assert len(requests_made) > ccdl.WRITE_QUEUE_DEPTH + 1
+    with open(path, 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_truncating_server_without_ranges_gives_up(tmp_path):
+    """Without Range support a partial body is no progress, the retries run out."""
+    p = packager(retries=3)
+    attempts = []
+
+    def request(method, url, headers=None, **kwargs):
+        attempts.append(headers.get('Range'))
+        return FakeResponse(200, BODY[:1024], drop=True, headers={'content-length': str(len(BODY))})
+
+    p.transport.request = request
+    p.metrics.add_ttfb = lambda response: None
+    path = str(tmp_path / 'pkg.zip')
+    try:
+        p.downloader.fetch_file('http://cdn/pkg.zip', path, len(BODY), False, 'P', '1', 'pkg.zip')
+    except ccdl.TRANSIENT_ERRORS:
+        pass
+    else:
+        raise AssertionError('fetch_file did not give up')
+    assert len(attempts) == 4
+    assert attempts == [None] * 4
+
+
+def test_range_fallback_removes_segmented_file(tmp_path, monkeypatch):
+    """A server ignoring Range headers is downloaded in one stream, without a leftover .segments.part."""
+    monkeypatch.setattr(ccdl, 'SEGMENT_MIN_SIZE', 1)
+    p = packager(segments=4)
+
+    def request(method, url, headers=None, **kwargs):
+        return FakeResponse(200, BODY, drop=False, headers={'content-length': str(len(BODY))})
+
+    p.transport.request = request
+    p.metrics.add_ttfb = lambda response: None
+    path = str(tmp_path / 'pkg.zip')
+    p.downloader.fetch_file('http://cdn/pkg.zip', path, len(BODY), True, 'P', '1', 'pkg.zip')
+    assert sorted(os.listdir(str(tmp_path))) == ['pkg.zip']
+    with open(path, 'rb') as f:
+        assert f.read() == BODY
+
+
+def test_failed_mirror_fill_removes_part_file(tmp_path):
+    """An upstream closing early leaves neither a cached body nor the part file behind."""
+    p = packager(cacheDir=str(tmp_path))
+
+    class TruncatedResponse(FakeResponse):
+        def iter_content(self, size):
+            yield BODY[:1024]
+
+    p.transport.request = lambda method, url, headers=None, **kwargs: TruncatedResponse(
+        200, b'', drop=False, headers={'content-length': str(len(BODY))})
+    os.makedirs(str(tmp_path / 'mirror'))
+    server = ccdl.MirrorServer(('127.0.0.1', 0), p)
+    try:
+        fill = ccdl.MirrorFill(str(tmp_path / 'mirror' / 'key.1.part'))
+        server.fill('key', 'https://ccmdls.adobe.com/pkg.zip', {}, fill)
+    finally:
+        server.server_close()
+    assert isinstance(fill.error, ccdl.DownloadError)
+    assert os.listdir(str(tmp_path / 'mirror')) == []
+
+
+def test_failing_package_does_not_stop_the_others(tmp_path):
+    """A package dropping its connection until the retries run out is reported, the other one is downloaded."""
+    p = packager(retries=2)
+
+    def request(method, url, headers=None, **kwargs):
+        if method == 'head':
+            return FakeResponse(200, b'', drop=False, headers={'content-length': str(len(BODY))})
+        if url.endswith('bad.zip'):
+            return FakeResponse(200, b'', drop=True, headers={'content-length': str(len(BODY))})
+        return FakeResponse(200, BODY, drop=False, headers={'content-length': str(len(BODY))})
+
+    p.transport.request = request
+    p.metrics.add_ttfb = lambda response: None
+    tasks = [{'url': 'http://cdn/{}.zip'.format(name), 'product_dir': str(tmp_path), 'sapCode': 'P',
+              'version': '1', 'size': len(BODY)} for name in ('bad', 'good')]
+    failed = p.downloader.download_packages(tasks)
+    assert failed == ['http://cdn/bad.zip']
+    with open(str(tmp_path / 'good.zip'), 'rb') as f:
+        assert f.read() == BODY
+
+
+class GzipOrigin(BaseHTTPRequestHandler):
+    """Stand-in CDN compressing its answers for every client that accepts gzip."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = BODY
+        self.send_response(200)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_mirror_caches_compressible_responses(tmp_path):
+    """A gzipping upstream is mirrored with the full body and cached."""
+    origin = ThreadingHTTPServer(('127.0.0.1', 0), GzipOrigin)
+    host = '127.0.0.1:{}'.format(origin.server_address[1])
+    p = packager(cacheDir=str(tmp_path), serveAllowHost=[host])
+    mirror = ccdl.MirrorServer(('127.0.0.1', 0), p)
+    for server in (origin, mirror):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = 'http://127.0.0.1:{}/http/{}/feed.xml'.format(mirror.server_address[1], host)
+        for _ in range(2):
+            response = ccdl.requests.get(url, timeout=10)
+            assert response.status_code == 200
+            assert response.content == BODY
+    finally:
+        for server in (origin, mirror):
+            server.shutdown()
+            server.server_close()
+    assert len([f for f in os.listdir(str(tmp_path / 'mirror')) if not f.endswith('.json')]) == 1
+
+
+def test_store_lock_is_shared_between_packagers(tmp_path):
+    """Packagers with their own thread locks, like separate runs, still take turns on a store entry."""
+    store_path = str(tmp_path / 'entry.zip')
+    first, second = packager(store=str(tmp_path)), packager(store=str(tmp_path))
+    held = threading.Event()
+    order = []
+
+    def hold():
+        with first.downloader.package_store_lock(store_path):
+            held.set()
+            time.sleep(0.3)
+            order.append('first')
+
+    worker = threading.Thread(target=hold)
+    worker.start()
+    held.wait(10)
+    with second.downloader.package_store_lock(store_path):
+        order.append('second')
+    worker.join()
+    assert order == ['first', 'second']